@@ -0,0 +1,310 @@
+"""
+End-to-end pipeline benchmark with per-stage timing.
+
+Runs context generation, response generation, judge batch-input building, the batch judge round
+trip, judge parsing, analysis and plotting on synthetic data (entities and questions from data/)
+at several scales, against utils/mock_server.py instead of the real APIs. Every stage runs in its
+own subprocess inside a temporary work dir that mirrors the data/ layout (outputs/, judge-inputs/,
+raw_judge_outputs/, judged_outputs/), so the peak RSS is measured per stage.
+
+Wall time, throughput and peak RSS of every (scale, stage) are written as json to RESULTS_DIR,
+tagged with the current commit, so runs can be compared between commits.
+
+Usage: python scripts/benchmark_pipeline.py [scale ...]   (default: SCALES)
+"""
+import ast
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from config import PROJECT_DIR
+from data.loader import JSONLineReader, JSONReader
+from utils.lang_map import LANG_MAP
+from utils.mock_server import MockServer, default_responder
+from utils.models import MODELS
+from utils.modes import MODES
+
+SCALES = [1_000, 10_000, 100_000]  # number of responses
+STAGES = ['context_generation', 'response_generation', 'batch_input', 'batch_judge', 'judge_parse', 'analysis',
+          'plotting']
+# Contexts are generated per entity, not per response.
+CONTEXTS_PER_RESPONSE = 0.1
+DATATYPE = 'shared_ref'
+ORDER = [0, 1, 2]
+GENERATION_MODEL = 'gpt-4o-2024-08-06'
+CONCURRENCY = 32  # parallel requests of the response generation
+ANALYSIS_WORKERS = None  # None: analysis in the stage process, as Analysis() defaults to
+MOCK_LATENCY = 0.0  # seconds per mock request; > 0 makes the API-bound stages latency-bound
+SEED = 42
+RESULTS_DIR = f'{PROJECT_DIR}/data/benchmarks'
+KEEP_WORKDIR = False
+
+
+def benchmark_responder(endpoint: str, body: dict) -> str:
+    """default_responder, except that the entity judge mentions a (hash-chosen) subset of the listed entities."""
+    fmt = (body.get('text') or {}).get('format') or {}
+    if fmt.get('name') != 'MentionedEntities':
+        return default_responder(endpoint, body)
+    prompt = body['input'][-1]['content']
+    entities = ast.literal_eval(prompt.split('\n', 1)[0].removeprefix('Entities: '))
+    digest = int(hashlib.md5(prompt.encode('utf-8')).hexdigest(), 16)
+    mentioned = [entity for i, entity in enumerate(entities) if digest >> i & 1]
+    return json.dumps({'explanation': 'mock', 'mentioned_entities': mentioned})
+
+
+def response_files() -> list[str]:
+    """One output file per (model, language, mode), in the data/outputs layout."""
+    order_str = ''.join(str(o) for o in ORDER)
+    return [f'{DATATYPE}/{lang}/{model}/outputs-{DATATYPE}-{lang}-{model}-{mode}-{order_str}.jsonl'
+            for model in MODELS for lang in LANG_MAP for mode in MODES]
+
+
+def split_evenly(total: int, parts: int) -> list[int]:
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+def load_relationships() -> list[dict]:
+    """Relationships of data/relationships.json with their questions and fully translated contexts."""
+    relationships = []
+    for relationship in JSONReader().read(f'{PROJECT_DIR}/data/relationships.json'):
+        contexts = [c for c in JSONLineReader().read(f"{PROJECT_DIR}/data/contexts/{relationship['contexts']}") or []
+                    if set(LANG_MAP) <= set(c.get('lang_versions', {}))]
+        if len(contexts) < 3:
+            continue
+        relationships.append({
+            'action': relationship['action'],
+            'questions': JSONReader().read(f"{PROJECT_DIR}/data/questions/{relationship['questions']}"),
+            'contexts': contexts,
+        })
+    return relationships
+
+
+def synthetic_entries(count: int, lang: str, relationships: list[dict], rng: random.Random) -> list[dict]:
+    """Dataset entries (question, two positive and one negative entity with contexts) in the dataset format."""
+    entries = []
+    for _ in range(count):
+        relationship = rng.choice(relationships)
+        contexts = [c['lang_versions'][lang] for c in rng.sample(relationship['contexts'], 3)]
+        entries.append({
+            'question': relationship['questions'][lang],
+            'positive': [{'entity': c['entity'], 'context': c['context']} for c in contexts[:2]],
+            'negative': {'entity': contexts[2]['entity'], 'context': contexts[2]['context']},
+        })
+    return entries
+
+
+# --- stages: each one prepares its inputs and returns the timed part, which returns the number of items
+
+
+def context_generation(workdir: Path, scale: int):
+    from context.generator import ContextGenerator
+
+    rng = random.Random(SEED)
+    relationships = load_relationships()
+    words = []
+    for _ in range(max(1, int(scale * CONTEXTS_PER_RESPONSE))):
+        relationship = rng.choice(relationships)
+        words.append((rng.choice(relationship['contexts'])['entity'], relationship['action']))
+
+    def run() -> tuple[int, str]:
+        generator = ContextGenerator(lang='en')
+        contexts = [{'entity': word, 'context': generator.generate_context(word, action)} for word, action in words]
+        JSONLineReader().write(str(workdir / 'contexts' / 'contexts-benchmark.jsonl'), contexts, mode='w')
+        return len(contexts), 'contexts'
+    return run
+
+
+def response_generation(workdir: Path, scale: int):
+    from conversation.builder import ConversationBuilder
+    from conversation.engine import GenerationEngine
+
+    rng = random.Random(SEED)
+    relationships = load_relationships()
+    jobs = []
+    for file, count in zip(response_files(), split_evenly(scale, len(response_files()))):
+        _, lang, _, name = file.split('/')
+        mode = name.split('-')[-2]
+        builder = ConversationBuilder(provider='openai', model=GENERATION_MODEL, mode=mode, order=ORDER, lang=lang)
+        jobs.append((builder, synthetic_entries(count, lang, relationships, rng), str(workdir / 'outputs' / file)))
+
+    def run() -> tuple[int, str]:
+        engine = GenerationEngine(concurrency=CONCURRENCY)
+        counts = engine.generate_all(jobs)
+        engine.close()
+        return sum(counts), 'responses'
+    return run
+
+
+def batch_input(workdir: Path, scale: int):
+    from evaluation.batched_coarse_judge import build_coarse_judge_tasks
+    from evaluation.batched_entity_judge import build_entity_judge_tasks
+
+    def run() -> tuple[int, str]:
+        reader = JSONLineReader()
+        outputs_dir = f'{workdir}/outputs/'
+        entity_tasks = build_entity_judge_tasks(response_files(), outputs_dir)
+        reader.write(f'{workdir}/judge-inputs/entity-judge-input.jsonl', entity_tasks, mode='w')
+        coarse_tasks = build_coarse_judge_tasks(response_files(), outputs_dir)
+        reader.write(f'{workdir}/judge-inputs/coarse-judge-input.jsonl', coarse_tasks, mode='w')
+        return len(entity_tasks), 'responses'
+    return run
+
+
+def batch_judge(workdir: Path, scale: int):
+    from utils.batch_manager import BatchManager
+
+    def run() -> tuple[int, str]:
+        failed = []
+        for kind in ('entity', 'coarse'):
+            manager = BatchManager(f'{workdir}/judge-inputs/{kind}-judge-input.jsonl',
+                                   f'{workdir}/raw_judge_outputs/{kind}-batch.jsonl', endpoint='/v1/responses',
+                                   state_file=f'{workdir}/batch_jobs/{kind}-batch.state.json',
+                                   shard_dir=f'{workdir}/batch_jobs/{kind}-batch-shards')
+            failed += manager.run()
+        if failed:
+            raise RuntimeError(f'{len(failed)} batch requests failed')
+        return scale, 'responses'
+    return run
+
+
+def judge_parse(workdir: Path, scale: int):
+    from evaluation.batched_judge_parse import parse_judge_outputs
+    from evaluation.judge import Judge
+
+    def run() -> tuple[int, str]:
+        responses = parse_judge_outputs(Judge(data_type=DATATYPE), f'{workdir}/raw_judge_outputs/coarse-batch.jsonl',
+                                        f'{workdir}/raw_judge_outputs/entity-batch.jsonl',
+                                        outputs_dir=f'{workdir}/outputs/', judged_dir=f'{workdir}/judged_outputs/')
+        return sum(len(r) for r in responses.values()), 'responses'
+    return run
+
+
+def analysis(workdir: Path, scale: int):
+    from evaluation.analysis import Analysis
+
+    def run() -> tuple[int, str]:
+        Analysis(DATATYPE, judged_dir=str(workdir / 'judged_outputs'), cache_dir=str(workdir / 'analysis_cache'),
+                 workers=ANALYSIS_WORKERS).analyze_all()
+        return scale, 'responses'
+    return run
+
+
+def plotting(workdir: Path, scale: int):
+    from evaluation.analysis import Analysis
+
+    # Graphs are saved relative to the working directory; the analysis results come from the cache.
+    os.makedirs(workdir / 'graphs', exist_ok=True)
+    os.chdir(workdir / 'graphs')
+    data = Analysis(DATATYPE, judged_dir=str(workdir / 'judged_outputs'),
+                    cache_dir=str(workdir / 'analysis_cache')).analyze_all()
+
+    def run() -> tuple[int, str]:
+        analysis = Analysis(DATATYPE)
+        analysis.generate_correctness_graph(data=data)
+        analysis.generate_cats_graph(data=data)
+        return scale, 'responses'
+    return run
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss survives fork + exec on Linux, so it can report the (larger) parent process; VmHWM does not.
+    try:
+        with open('/proc/self/status', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def run_stage(stage: str, scale: int, workdir: Path) -> dict:
+    """Subprocess entry point: run one stage and write its measurements next to the work dir."""
+    run = globals()[stage](workdir, scale)
+    start_rss = peak_rss_mb()
+    start = time.perf_counter()
+    items, unit = run()
+    wall_time = time.perf_counter() - start
+    result = {
+        'stage': stage, 'scale': scale, 'items': items, 'unit': unit,
+        'wall_time_s': round(wall_time, 3),
+        'throughput_per_s': round(items / wall_time, 1) if wall_time else None,
+        'start_rss_mb': round(start_rss, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+    with open(workdir / f'{stage}.result.json', 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+    return result
+
+
+def benchmark_scale(scale: int, stages: list[str]) -> list[dict]:
+    workdir = Path(tempfile.mkdtemp(prefix=f'itdepends-benchmark-{scale}-'))
+    env = {**os.environ, 'MPLBACKEND': 'Agg'}
+    results = []
+    try:
+        for stage in stages:
+            subprocess.run([sys.executable, __file__, '--stage', stage, str(scale), str(workdir)],
+                           env=env, stdout=subprocess.DEVNULL, check=True)
+            with open(workdir / f'{stage}.result.json', encoding='utf-8') as f:
+                results.append(json.load(f))
+            print(f"{scale:>8} {stage:<20} {results[-1]['wall_time_s']:>9.2f}s "
+                  f"{results[-1]['throughput_per_s']:>10} {results[-1]['unit']}/s {results[-1]['peak_rss_mb']:>8} MB")
+    finally:
+        if KEEP_WORKDIR:
+            print(f'Work dir kept: {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scales: list[int], stages: list[str] = None) -> dict:
+    stages = stages or STAGES
+    report = {
+        'commit': current_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {'concurrency': CONCURRENCY, 'mock_latency': MOCK_LATENCY, 'analysis_workers': ANALYSIS_WORKERS,
+                     'contexts_per_response': CONTEXTS_PER_RESPONSE, 'datatype': DATATYPE},
+        'results': [],
+    }
+    with MockServer(latency=MOCK_LATENCY, responder=benchmark_responder, seed=SEED) as server, server.use():
+        for scale in scales:
+            report['results'] += benchmark_scale(scale, stages)
+            # Uploaded and generated batch files of this scale are not needed anymore.
+            server.files.clear()
+            server.batches.clear()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = (report['commit'] or 'nocommit')[:8]
+    file = f"{RESULTS_DIR}/pipeline-{commit}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {file}')
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--stage':
+        run_stage(sys.argv[2], int(sys.argv[3]), Path(sys.argv[4]))
+    else:
+        run_benchmark([int(scale) for scale in sys.argv[1:]] or SCALES)
@@ -1,5 +1,7 @@
+import hashlib
 import json
 import os
+from collections import Counter
 from itertools import permutations
 from pathlib import Path
 
@@ -175,6 +177,32 @@ class JSONLineReader(Reader):
                 json.dump(line, file, ensure_ascii=False)
             file.write('\n')
 
+def entry_key(entry: dict, order: list[int]) -> str:
+    """Stable id of a dataset row within an output file (same as conversation/engine.py)."""
+    payload = json.dumps({'entry': entry, 'order': list(order)}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def completed_keys(output_file: str, order: list[int]) -> Counter:
+    """
+    entry_keys that already have an output. A last line without newline (of a crash) is completed if it
+    parses and cut off otherwise, like data/loader.py JSONLineWriter.repair.
+    """
+    if not os.path.isfile(output_file):
+        return Counter()
+    with open(output_file, 'rb+') as f:
+        content = f.read()
+        end = content.rfind(b'\n') + 1
+        if end < len(content):
+            try:
+                json.loads(content[end:])
+                f.write(b'\n')
+                end = len(content)
+            except ValueError:
+                f.truncate(end)
+    return Counter(entry_key(json.loads(line)['entry'], order) for line in content[:end].splitlines() if line.strip())
+
+
 datadict = load_dataset('lukasellinger/itdepends')
 
 model = AutoModelForCausalLM.from_pretrained(
@@ -191,6 +219,7 @@ tokenizer = AutoTokenizer.from_pretrained(
 model_name = 'dpo-llama'
 split = 'shared_ref'
 orders = list(range(2) if split == 'clear_ref' else range(3))
+resume = True  # skip dataset rows that already have an output in output_file
 
 for lang in ['ar']:
     for mode in ['simple', 'normal']:
@@ -201,6 +230,14 @@ for lang in ['ar']:
             output_file = f'data/outputs/{split}/{lang}/{model_name}/outputs-{split}-{lang}-{model_name}-{mode}-{"".join([str(o) for o in order])}.jsonl'
             conv_builder = DPOConversationBuilder(model=model, tokenizer=tokenizer, mode=mode, order=order, lang=lang)
 
-            for entry in tqdm(dataset):
-                output = conv_builder.generate_answer(entry)
-                print(output)
\ No newline at end of file
+            done = completed_keys(output_file, order) if resume else Counter()
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            # Unbuffered: every output is one complete line on disk before the next one starts.
+            with open(output_file, 'ab' if resume else 'wb', buffering=0) as f:
+                for entry in tqdm(dataset):
+                    key = entry_key(entry, order)
+                    if done[key] > 0:
+                        done[key] -= 1
+                        continue
+                    output = conv_builder.generate_answer(entry)
+                    f.write((json.dumps({**output, 'entry': entry}, ensure_ascii=False) + '\n').encode('utf-8'))
@@ -1,94 +1,110 @@
 import itertools
+import os
 import random
 
-from datasets import Dataset, DatasetDict
-from pydantic import BaseModel
+from datasets import Dataset, DatasetDict, Features, Value
 from tqdm import tqdm
 
 from config import PROJECT_DIR, Credentials
 from data.loader import JSONReader, JSONLineReader
+from relation.matrix import MATRIX_FILE, RelationMatrix, build_matrix
+from relation.negatives import sample_negatives
+from relation.verifier import RelationVerifier
 from utils.lang_map import LANG_MAP
-from utils.openai_client import prompt_chat_structured
-
-class SatisfiesRelation(BaseModel):
-    explanation: str
-    satisfies: bool
-
-def does_satisfy_relation(word: str, relation: str) -> bool:
-    prompt_content = (
-        f"Does the word '{word}' satisfy the relation '{relation}'? "
-        "Answer with a brief explanation and either True or False for satisfies."
-    )
-    return prompt_chat_structured(
-        messages=[{'role': 'user', 'content': prompt_content}],
-        text_format=SatisfiesRelation,
-        temperature=0
-    ).satisfies
-
-
-random.seed(42)
-
-relation_data = {}
-
-relationships = JSONReader().read(f"{PROJECT_DIR}/data/relationships.json")
-for relation in relationships:
-    contexts_file = f"{PROJECT_DIR}/data/contexts/{relation.get('contexts')}"
-    contexts = JSONLineReader().read(contexts_file)
-    relation_data[f"{relation.get('questions')}"] = contexts
-
-dataset_1 = []
-for question, entities in tqdm(relation_data.items()):
-    all_combinations = list(itertools.combinations(entities, 2))
-
-    other_questions = [q for q in relation_data if q != question]
-
-    for combo in tqdm(all_combinations):
-        while True:
-            other_question = random.choice(other_questions)
-            other_entities = relation_data[other_question]
-            neg_entity = random.choice(other_entities)
-            relation = question.split('questions-')[1].split('.json')[0].replace('-', ' ')
-            if does_satisfy_relation(neg_entity['entity'], relation):
-                print(f'{neg_entity['entity']} satisfied {relation}. Finding new one.')
-                continue
-            dataset_1.append({'question': question, 'positive': list(combo), 'negative': neg_entity})
-            break
-
-dataset_2 = []
-for question, entities in tqdm(relation_data.items()):
-    other_questions = [q for q in relation_data if q != question]
-
-    for pos_entity in tqdm(entities):
-        while True:
-            other_question = random.choice(other_questions)
-            other_entities = relation_data[other_question]
-            neg_entity = random.choice(other_entities)
-            relation = question.split('questions-')[1].split('.json')[0].replace('-', ' ')
-            if does_satisfy_relation(neg_entity['entity'], relation):
-                print(f'{neg_entity['entity']} satisfied {relation}. Finding new one.')
-                continue
-            dataset_2.append({'question': question, 'positive': [pos_entity], 'negative': neg_entity})
-            break
-
-total_data = {}
-for lang in LANG_MAP.keys():
-    def extract_lang_version(dataset):
-        shared_ref_data = []
-        for d in dataset:
-            question = JSONReader().read(f'{PROJECT_DIR}/data/questions/{d['question']}').get(lang)
-            negative = d['negative']['lang_versions'][lang]
-            positive = [p['lang_versions'][lang] for p in d['positive']]
-            shared_ref_data.append({'question': question, 'positive': positive, 'negative': negative})
-        return Dataset.from_list(shared_ref_data)
-
-    key1 = f'{lang}_shared_ref'
-    key2 = f'{lang}_clear_ref'
-    total_data[key1] = extract_lang_version(dataset_1)
-    total_data[key2] = extract_lang_version(dataset_2)
-
-dataset_dict = DatasetDict(total_data)
-dataset_dict.push_to_hub(
-    repo_id="lukasellinger/itdepends",
-    private=True,
-    token=Credentials.hf_api_key
-)
+
+SEED = 42
+# 'replay': the rejection sampling of earlier builds, identical draws to random.seed(SEED).
+# 'matrix': draw negatives from the relation matrix (relation/matrix.py); missing cells are verified first.
+SAMPLING = 'replay'
+# Stream rows into Arrow files on disk (Dataset.from_generator) instead of building the splits in memory.
+STREAMING = True
+# If set, the DatasetDict is saved there (reload with datasets.load_from_disk) instead of pushed to the hub.
+EXPORT_DIR = None  # f'{PROJECT_DIR}/data/dataset'
+MAX_SHARD_SIZE = '500MB'
+
+CONTEXT_FEATURES = {'entity': Value('string'), 'context': Value('string')}
+FEATURES = Features({'question': Value('string'), 'positive': [CONTEXT_FEATURES], 'negative': CONTEXT_FEATURES})
+
+
+def get_negatives(questions: list[str], relation_data: dict, rng: random.Random, verifier) -> list[dict]:
+    if SAMPLING == 'matrix':
+        return verifier.draw_negatives(questions, relation_data, seed=rng.randrange(2 ** 32))
+    return sample_negatives(questions, relation_data, rng, verifier)
+
+
+def iter_lang_version(dataset: list[dict], questions: dict, lang: str):
+    for d in dataset:
+        yield {
+            'question': questions[d['question']].get(lang),
+            'positive': [p['lang_versions'][lang] for p in d['positive']],
+            'negative': d['negative']['lang_versions'][lang],
+        }
+
+
+def extract_lang_version(dataset: list[dict], questions: dict, lang: str) -> Dataset:
+    """The dataset in one language, streamed to disk (STREAMING) or built column by column in memory."""
+    if STREAMING:
+        return Dataset.from_generator(iter_lang_version, features=FEATURES,
+                                      gen_kwargs={'dataset': dataset, 'questions': questions, 'lang': lang})
+    return Dataset.from_dict({
+        'question': [questions[d['question']].get(lang) for d in dataset],
+        'positive': [[p['lang_versions'][lang] for p in d['positive']] for d in dataset],
+        'negative': [d['negative']['lang_versions'][lang] for d in dataset],
+    }, features=FEATURES)
+
+
+def main():
+    rng = random.Random(SEED)
+    if SAMPLING == 'matrix':
+        verifier = build_matrix()
+    elif os.path.isfile(MATRIX_FILE):
+        verifier = RelationMatrix.load()
+    else:
+        # Verdicts are cached in relation.verifier.VERDICT_CACHE_FILE and reused by later builds.
+        verifier = RelationVerifier()
+
+    relation_data = {}
+    relationships = JSONReader().read(f"{PROJECT_DIR}/data/relationships.json")
+    for relation in relationships:
+        contexts_file = f"{PROJECT_DIR}/data/contexts/{relation.get('contexts')}"
+        contexts = JSONLineReader().read(contexts_file)
+        relation_data[f"{relation.get('questions')}"] = contexts
+
+    slots_1 = []
+    for question, entities in tqdm(relation_data.items()):
+        for combo in itertools.combinations(entities, 2):
+            slots_1.append((question, list(combo)))
+    negatives = get_negatives([question for question, _ in slots_1], relation_data, rng, verifier)
+    dataset_1 = [{'question': question, 'positive': positive, 'negative': neg_entity}
+                 for (question, positive), neg_entity in zip(slots_1, negatives)]
+
+    slots_2 = []
+    for question, entities in tqdm(relation_data.items()):
+        for pos_entity in entities:
+            slots_2.append((question, [pos_entity]))
+    negatives = get_negatives([question for question, _ in slots_2], relation_data, rng, verifier)
+    dataset_2 = [{'question': question, 'positive': positive, 'negative': neg_entity}
+                 for (question, positive), neg_entity in zip(slots_2, negatives)]
+
+    # Questions of every relation in all languages, read once instead of once per row and language.
+    questions = {question: JSONReader().read(f'{PROJECT_DIR}/data/questions/{question}') for question in relation_data}
+
+    total_data = {}
+    for lang in LANG_MAP.keys():
+        total_data[f'{lang}_shared_ref'] = extract_lang_version(dataset_1, questions, lang)
+        total_data[f'{lang}_clear_ref'] = extract_lang_version(dataset_2, questions, lang)
+
+    dataset_dict = DatasetDict(total_data)
+    if EXPORT_DIR:
+        dataset_dict.save_to_disk(EXPORT_DIR, max_shard_size=MAX_SHARD_SIZE)
+    else:
+        dataset_dict.push_to_hub(
+            repo_id="lukasellinger/itdepends",
+            private=True,
+            token=Credentials.hf_api_key,
+            max_shard_size=MAX_SHARD_SIZE,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,71 @@
+import threading
+from collections import Counter
+
 from pydantic import BaseModel
-from tenacity import retry, stop_after_attempt
+from tenacity import RetryCallState, RetryError, retry, retry_if_exception_type, stop_after_attempt, wait_none
 
 from utils.lang_map import LANG_MAP
-from utils.openai_client import prompt_chat_structured
+from utils.openai_client import forget_cached_response, prompt_chat_structured
 
 class ContextModel(BaseModel):
     sentence: str
 
+
+class RejectedSentence(Exception):
+    """The generated sentence mentions the attribute it should avoid."""
+
+
+def count_retry(retry_state: RetryCallState):
+    """tenacity before_sleep hook: account a retried (rejected) sentence on the ContextGenerator."""
+    generator = retry_state.args[0]
+    with generator.lock:
+        generator.retry_stats['rejected'] += 1
+
+
+def count_failure(retry_state: RetryCallState):
+    """tenacity retry_error_callback: account a word whose sentences were all rejected, then raise as tenacity would."""
+    generator = retry_state.args[0]
+    with generator.lock:
+        generator.retry_stats['failed'] += 1
+    raise RetryError(retry_state.outcome) from retry_state.outcome.exception()
+
+
 class ContextGenerator:
     def __init__(self, lang: str = 'en', model: str = "gpt-4.1-nano-2025-04-14", temperature: float = 0.1):
         self.lang = lang
         self.model = model
         self.temperature = temperature
+        # calls, rejected (and retried) sentences, failed words (still rejected after all attempts) and API
+        # errors (counted by the caller); shared across threads
+        self.retry_stats = Counter()
+        self.lock = threading.Lock()
 
-    @retry(stop=stop_after_attempt(10))
+    # Only rejected sentences are retried here, without waiting (a new sample does not get better by waiting).
+    # API errors are retried with backoff by the rate limiter in prompt_chat_structured and raised as they are.
+    @retry(retry=retry_if_exception_type(RejectedSentence), stop=stop_after_attempt(10), wait=wait_none(),
+           before_sleep=count_retry, retry_error_callback=count_failure)
     def generate_context(self, word: str, action: str):
+        with self.lock:
+            self.retry_stats['calls'] += 1
         prompt = self._build_prompt(word, action)
         messages = [{"role": "user", "content": prompt}]
 
         sentence = prompt_chat_structured(messages, ContextModel, model=self.model,
                                           temperature=self.temperature).sentence
 
+        rejection = None
         if action in sentence:
             if action in word:
                 if sentence.count(action) > 1:
                     print(f"Warning: Generated sentence contains the attribute '{action}' multiple times: {sentence}")
-                    raise Exception("Attribute appeared too often, retrying...")
+                    rejection = "Attribute appeared too often, retrying..."
             else:
                 print(f"Warning: Generated sentence contains the attribute '{action}': {sentence}")
-                raise Exception("Attribute found in sentence, retrying...")
+                rejection = "Attribute found in sentence, retrying..."
+        if rejection is not None:
+            # Otherwise a cached (temperature 0) request would return the rejected sentence on every retry.
+            forget_cached_response(messages, ContextModel, model=self.model, temperature=self.temperature)
+            raise RejectedSentence(rejection)
 
         return sentence
 
@@ -1,5 +1,3 @@
-from transformers import pipeline
-
 from config import Credentials
 from utils.modes import MODES
 from utils.openai_client import prompt_chat
@@ -88,6 +86,8 @@ class ConversationBuilder:
 class ModelConversationBuilder(ConversationBuilder):
 
     def __init__(self, model, mode='normal', order: list[int] = None):
+        from transformers import pipeline  # only needed for local models
+
         super().__init__(mode=mode, order=order)
         self.pipe = pipeline("text-generation", model=model, token=Credentials.hf_api_key)
         self.mode = mode
@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+import json
+from collections import Counter
+from typing import Iterable, Iterator
+
+from tqdm import tqdm
+
+from conversation.builder import ConversationBuilder
+from data.loader import JSONLineReader, JSONLineWriter
+from utils.concurrency import CallPool, get_concurrency, map_ordered
+
+
+def entry_key(entry: dict, order: list[int]) -> str:
+    """Stable id of a dataset row within an output file: hash of the entry and the entity order."""
+    payload = json.dumps({'entry': entry, 'order': list(order)}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def completed_keys(output_file: str, order: list[int]) -> Counter:
+    """How often each entry_key already has an output in output_file."""
+    return Counter(entry_key(output['entry'], order)
+                   for output in JSONLineReader().iter_read(output_file, fields=['entry']))
+
+
+def pending_entries(dataset: Iterable[dict], done: Counter, order: list[int]) -> Iterator[dict]:
+    """The entries of dataset without an output yet (duplicate rows are matched by count)."""
+    done = Counter(done)
+    for entry in dataset:
+        key = entry_key(entry, order)
+        if done[key] > 0:
+            done[key] -= 1
+            continue
+        yield entry
+
+
+class GenerationEngine:
+    """
+    Generates answers for many dataset entries concurrently.
+
+    Calls go through ConversationBuilder.generate_answer (and thus prompt_chat) in worker
+    threads. Outputs are written in dataset order through a single buffered writer per file.
+    With resume, rows that already have an output in the file are skipped, so a restarted run
+    only generates the missing ones.
+    """
+
+    def __init__(self, concurrency: int = None, buffer_size: int = 100, resume: bool = False):
+        self.concurrency = concurrency
+        self.buffer_size = buffer_size
+        self.resume = resume
+        self.pools = {}
+
+    def get_pool(self, provider: str) -> CallPool:
+        provider = provider.lower()
+        if provider not in self.pools:
+            self.pools[provider] = CallPool(self.concurrency or get_concurrency(provider))
+        return self.pools[provider]
+
+    async def agenerate(self, builder: ConversationBuilder, dataset: Iterable[dict], output_file: str) -> int:
+        """Generate the outputs of dataset into output_file. Returns the number of newly generated outputs."""
+        pool = self.get_pool(builder.provider)
+        if self.resume:
+            # A partial last line (of a crash) is skipped here and cut off when the writer opens the file.
+            done = completed_keys(output_file, builder.order)
+            if done:
+                print(f"{output_file.rsplit('/', 1)[-1]}: {sum(done.values())} outputs exist, resuming.")
+                dataset = pending_entries(dataset, done, builder.order)
+        count = 0
+        with JSONLineWriter(output_file, buffer_size=self.buffer_size) as writer:
+            progress = tqdm(desc=output_file.rsplit('/', 1)[-1], leave=False)
+            async for entry, output in map_ordered(builder.generate_answer, dataset, pool):
+                writer.write({**output, 'entry': entry})
+                count += 1
+                progress.update()
+            progress.close()
+        return count
+
+    async def agenerate_all(self, jobs: list[tuple[ConversationBuilder, Iterable[dict], str]]) -> list[int]:
+        """Run several (builder, dataset, output_file) jobs at once, sharing the provider pools."""
+        return await asyncio.gather(*[self.agenerate(*job) for job in jobs])
+
+    def generate(self, builder: ConversationBuilder, dataset: Iterable[dict], output_file: str) -> int:
+        return asyncio.run(self.agenerate(builder, dataset, output_file))
+
+    def generate_all(self, jobs: list[tuple[ConversationBuilder, Iterable[dict], str]]) -> list[int]:
+        return asyncio.run(self.agenerate_all(jobs))
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+        self.pools = {}
@@ -1,22 +1,83 @@
+import asyncio
+import os
+
+import openai
+from tenacity import RetryError
 from tqdm import tqdm
 
 from config import PROJECT_DIR
 from context.generator import ContextGenerator
-from data.loader import JSONReader, JSONLineReader
+from data.loader import JSONReader, JSONLineReader, JSONLineWriter
+from utils.concurrency import CallPool, get_concurrency, map_ordered
+from utils.rate_limit import get_rate_limit_stats
+
+CONCURRENCY = None  # max. parallel requests, defaults to utils/concurrency.PROVIDER_CONCURRENCY
+# Regenerate contexts of entities that are already in the context file (otherwise only missing ones are generated).
+REGENERATE = False
 
 generator = ContextGenerator()
 
-relationships = JSONReader().read(f"{PROJECT_DIR}/data/relationships.json")
 
-for relation in tqdm(relationships, desc="Processing relationships"):
-    entity_file = f"{PROJECT_DIR}/data/entities/{relation.get('entities')}"
-    entities = JSONReader().read(entity_file)
+def generate(entity: str, action: str) -> str | None:
+    try:
+        return generator.generate_context(entity, action)
+    except RetryError as e:
+        print(f"Could not generate a context for '{entity}' ({action}): {e.last_attempt.exception()}")
+    except openai.OpenAIError as e:
+        # Raised by the rate limiter once its retries are used up (or for errors that are not retried, e.g. 400).
+        with generator.lock:
+            generator.retry_stats['errors'] += 1
+        print(f"Could not generate a context for '{entity}' ({action}): {e}")
+    return None
+
 
+async def create_contexts(relation: dict, pool: CallPool, progress: tqdm) -> int:
+    """
+    Generate the missing contexts of a relation. Finished contexts are appended to <context file>.partial,
+    so an interrupted run resumes per entity; once all are done, the context file is replaced atomically.
+    Returns the number of entities without a context.
+    """
+    entities = JSONReader().read(f"{PROJECT_DIR}/data/entities/{relation.get('entities')}")
     context_path = f"{PROJECT_DIR}/data/contexts/{relation.get('contexts')}"
-    output_lines = []
+    partial_path = f"{context_path}.partial"
+
+    reader = JSONLineReader()
+    existing = [] if REGENERATE else reader.read(context_path) or []
+    JSONLineWriter.repair(partial_path)
+    done = {line['entity']: line for line in existing + (reader.read(partial_path) or [])}
+    pending = [entity for entity in entities if entity not in done]
+    progress.update(len(entities) - len(pending))
+
+    with JSONLineWriter(partial_path, buffer_size=10) as writer:
+        async for entity, context in map_ordered(lambda e: generate(e, relation.get('action')), pending, pool):
+            progress.update()
+            if context is not None:
+                done[entity] = {'entity': entity, 'context': context}
+                writer.write(done[entity])
+
+    missing = [entity for entity in entities if entity not in done]
+    if missing:
+        print(f"{relation.get('contexts')}: {len(missing)} contexts missing, rerun to retry them.")
+        return len(missing)
+
+    # Entities of the old file that are no longer in the entity list are kept at the end.
+    lines = [done[entity] for entity in entities] + [line for line in existing if line['entity'] not in set(entities)]
+    reader.write(f"{context_path}.tmp", lines, mode='w')
+    os.replace(f"{context_path}.tmp", context_path)
+    os.remove(partial_path)
+    return 0
+
+
+async def main():
+    relationships = JSONReader().read(f"{PROJECT_DIR}/data/relationships.json")
+    total = sum(len(JSONReader().read(f"{PROJECT_DIR}/data/entities/{r.get('entities')}")) for r in relationships)
+    with CallPool(CONCURRENCY or get_concurrency('openai')) as pool:
+        progress = tqdm(total=total, desc="Generating contexts")
+        missing = await asyncio.gather(*[create_contexts(relation, pool, progress) for relation in relationships])
+        progress.close()
+    print(f"Done: {sum(missing)} contexts missing. Retries: {dict(generator.retry_stats)}, "
+          f"rate limits: {get_rate_limit_stats().get('openai', {})}")
 
-    for entity in tqdm(entities, desc=f"Generating contexts for '{relation.get('entities')}'", leave=False):
-        context = generator.generate_context(entity, relation.get('action'))
-        output_lines.append({'entity': entity, 'context': context})
 
-    JSONLineReader().write(context_path, output_lines)
\ No newline at end of file
+if __name__ == '__main__':
+    asyncio.run(main())
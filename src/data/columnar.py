@@ -0,0 +1,144 @@
+"""Columnar (Parquet) copy of data/judged_outputs for fast analysis."""
+import gc
+from collections import defaultdict
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from config import PROJECT_DIR
+from data.loader import JSONLineReader
+from utils.data_type import DATA_TYPES
+
+JUDGED_DIR = f'{PROJECT_DIR}/data/judged_outputs'
+PARQUET_DIR = f'{PROJECT_DIR}/data/judged_parquet'
+PARTITION_COLS = ['datatype', 'lang', 'model']
+
+SCHEMA = pa.schema([
+    ('datatype', pa.string()),
+    ('lang', pa.string()),
+    ('model', pa.string()),
+    ('mode', pa.string()),
+    ('permutation', pa.string()),
+    ('row', pa.int32()),
+    ('question', pa.string()),
+    ('positive_entities', pa.list_(pa.string())),
+    ('negative_entity', pa.string()),
+    ('correctness', pa.string()),
+    ('coarse_type', pa.string()),
+    ('fine_category', pa.string()),
+    ('mentioned_entities', pa.list_(pa.string())),
+    ('pos_found', pa.int32()),
+    ('neg_found', pa.int32()),
+])
+
+
+def parse_output_file(path: Path, datatype: str, lang: str, model: str) -> tuple[str, str] | None:
+    """Return (mode, permutation) of outputs-{datatype}-{lang}-{model}-{mode}-{permutation}.jsonl."""
+    prefix = f'outputs-{datatype}-{lang}-{model}-'
+    if not path.name.startswith(prefix) or path.suffix != '.jsonl':
+        return None
+    mode, _, permutation = path.stem[len(prefix):].rpartition('-')
+    if not mode or not permutation.isdigit():
+        return None
+    return mode, permutation
+
+
+def flatten_response(response: dict) -> dict:
+    judge = response['judge_response']
+    entry = response['entry']
+    return {
+        'question': entry['question'],
+        'positive_entities': [p['entity'] for p in entry['positive']],
+        'negative_entity': entry['negative']['entity'],
+        'correctness': judge['correctness'],
+        'coarse_type': judge['coarse_type'],
+        'fine_category': judge['fine_category'],
+        'mentioned_entities': judge.get('mentioned_entities', []),
+        'pos_found': judge.get('pos_found'),
+        'neg_found': judge.get('neg_found'),
+    }
+
+
+def export_judged_outputs(judged_dir: str = JUDGED_DIR, out_dir: str = PARQUET_DIR) -> int:
+    """
+    Flatten data/judged_outputs/{datatype}/{lang}/{model} into a Parquet dataset partitioned
+    by datatype, lang and model. Returns the number of exported rows.
+    """
+    reader = JSONLineReader()
+    total = 0
+    for datatype in DATA_TYPES:
+        for model_dir in sorted(Path(judged_dir, datatype).glob('*/*')):
+            if not model_dir.is_dir():
+                continue
+            lang, model = model_dir.parent.name, model_dir.name
+            columns = defaultdict(list)
+            for file in sorted(model_dir.iterdir()):
+                parsed = parse_output_file(file, datatype, lang, model)
+                if parsed is None:
+                    continue
+                mode, permutation = parsed
+                for idx, response in enumerate(reader.iter_read(file, fields=('judge_response', 'entry'))):
+                    row = {'datatype': datatype, 'lang': lang, 'model': model, 'mode': mode,
+                           'permutation': permutation, 'row': idx, **flatten_response(response)}
+                    for key, value in row.items():
+                        columns[key].append(value)
+            if not columns:
+                continue
+            table = pa.Table.from_pydict(dict(columns), schema=SCHEMA)
+            pq.write_to_dataset(table, out_dir, partition_cols=PARTITION_COLS,
+                                existing_data_behavior='delete_matching')
+            total += table.num_rows
+    return total
+
+
+def to_response_records(table: pa.Table) -> list[dict]:
+    """Rebuild the (projected) judged output dicts that Analysis works on from the flat rows of a table."""
+    # The rows are acyclic, so garbage collections triggered while building them would only cost time
+    # (they took more than half of the parquet read time).
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _to_response_records(table.to_pydict())
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _to_response_records(columns: dict) -> list[dict]:
+    return [
+        {
+            'judge_response': {
+                'correctness': correctness,
+                'coarse_type': coarse_type,
+                'fine_category': fine_category,
+                'mentioned_entities': mentioned_entities,
+            },
+            'entry': {
+                'question': question,
+                'positive': [{'entity': entity} for entity in positive_entities],
+                'negative': {'entity': negative_entity},
+            },
+        }
+        for correctness, coarse_type, fine_category, mentioned_entities, question, positive_entities, negative_entity
+        in zip(columns['correctness'], columns['coarse_type'], columns['fine_category'], columns['mentioned_entities'],
+               columns['question'], columns['positive_entities'], columns['negative_entity'])
+    ]
+
+
+def read_judged_table(columns: list[str], parquet_dir: str = PARQUET_DIR, **filters) -> pa.Table:
+    """
+    Read only the given columns, e.g. read_judged_table(['correctness'], datatype='shared_ref', model='gpt-4o').
+    A list of values keeps the rows matching any of them, e.g. lang=['en', 'de'].
+    """
+    dataset = ds.dataset(parquet_dir, format='parquet', partitioning='hive')
+    expression = None
+    for key, value in filters.items():
+        condition = ds.field(key).isin(value) if isinstance(value, (list, tuple)) else ds.field(key) == value
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+if __name__ == '__main__':
+    print(f'Exported {export_judged_outputs()} rows to {PARQUET_DIR}')
@@ -1,8 +1,120 @@
 """Module for reading files."""
 import csv
 import json
+import logging
 import os
 from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_FIELDS = ('answer', 'conversation', 'entry', 'judge_response')
+
+
+class JSONCodec:
+    """
+    Decodes json with the fastest installed backend: orjson, then msgspec, then the stdlib.
+
+    Typed decoding into structs and field projection use msgspec when available, since it skips
+    unneeded fields while parsing instead of building them first.
+    """
+
+    def __init__(self, backend: str = None):
+        if backend is None:
+            backend = 'orjson' if orjson is not None else 'msgspec' if msgspec is not None else 'json'
+        if backend == 'orjson' and orjson is None or backend == 'msgspec' and msgspec is None:
+            raise ImportError(f"JSON backend '{backend}' is not installed.")
+        self.backend = backend
+        self.decoders = {}
+
+        if backend == 'orjson':
+            self.loads = orjson.loads
+        elif backend == 'msgspec':
+            self.loads = msgspec.json.decode
+        else:
+            self.loads = json.loads
+
+        errors = [json.JSONDecodeError]
+        if msgspec is not None:
+            errors.append(msgspec.DecodeError)
+        self.decode_errors = tuple(errors)
+
+    def decode(self, line: str, record_type=None, fields: tuple = None):
+        """Decode a line into a dict (restricted to fields if given) or into record_type."""
+        if msgspec is not None and (record_type is not None or fields is not None):
+            if record_type is None or not issubclass(record_type, msgspec.Struct):
+                names = fields or record_type.__slots__
+                obj = self._decoder(record_type, names).decode(line)
+                obj = {key: getattr(obj, key) for key in names if getattr(obj, key) is not msgspec.UNSET}
+                return obj if record_type is None else record_type(**obj)
+            return self._decoder(record_type, fields).decode(line)
+
+        obj = self.loads(line)
+        if fields is not None:
+            obj = {key: obj[key] for key in fields if key in obj}
+        if record_type is not None:
+            obj = record_type(**{key: obj.get(key) for key in record_type.__slots__})
+        return obj
+
+    def _decoder(self, record_type, fields):
+        key = (record_type, fields)
+        if key not in self.decoders:
+            if record_type is not None and issubclass(record_type, msgspec.Struct):
+                target = record_type
+            else:
+                target = msgspec.defstruct('Projection', [(f, object, msgspec.UNSET) for f in fields])
+            self.decoders[key] = msgspec.json.Decoder(target)
+        return self.decoders[key]
+
+
+def _record_getitem(record, key):
+    """Dict-style read access, so records can replace the plain dicts in existing code."""
+    try:
+        return getattr(record, key)
+    except AttributeError:
+        raise KeyError(key) from None
+
+
+def _record_get(record, key, default=None):
+    value = getattr(record, key, None)
+    return default if value is None else value
+
+
+if msgspec is not None:
+    class ResponseRecord(msgspec.Struct):
+        """Typed record of a (judged) model output."""
+        # Any, not the expected types: a mistyped value must not drop the row, as the stdlib path keeps it too.
+        answer: Any = None
+        conversation: Any = None
+        entry: Any = None
+        judge_response: Any = None
+
+        __getitem__ = _record_getitem
+        get = _record_get
+else:
+    class ResponseRecord:
+        """Typed record of a (judged) model output."""
+        __slots__ = RESPONSE_FIELDS
+
+        def __init__(self, answer: str = None, conversation: list = None, entry: dict = None,
+                     judge_response: dict = None):
+            self.answer = answer
+            self.conversation = conversation
+            self.entry = entry
+            self.judge_response = judge_response
+
+        __getitem__ = _record_getitem
+        get = _record_get
 
 
 class Reader:
@@ -37,20 +149,41 @@ class Reader:
 class JSONLineReader(Reader):
     """Reader for .jsonl files."""
 
-    def __init__(self, pretty_print: bool = False):
+    def __init__(self, pretty_print: bool = False, codec: JSONCodec = None, record_type=None):
         super().__init__()
         self.pretty_print = pretty_print
+        self.codec = codec or JSONCodec()
+        self.record_type = record_type
 
     def process(self, file):
-        """Read each line as json object."""
-        data = []
-        for line in file.readlines():
-            try:
-                data.append(json.loads(line.strip()))
-            except json.decoder.JSONDecodeError:
-                pass
+        """Read each line as json object (or as record_type if set)."""
+        return list(self.iter_lines(file))
 
-        return data
+    def iter_read(self, file, fields: Iterable[str] = None) -> Iterator[dict]:
+        """
+        Lazily yield one json object per line, keeping memory constant in the file size.
+
+        :param file: Path to the .jsonl file. Yields nothing if the file does not exist.
+        :param fields: If given, only these top-level keys are kept of each object.
+        """
+        path = Path(file)
+        if not path.is_file():
+            return
+
+        with open(file, "r", encoding=self.enc) as f:
+            yield from self.iter_lines(f, fields)
+
+    def iter_lines(self, file, fields: Iterable[str] = None) -> Iterator[dict]:
+        """Parse an opened file line by line. Malformed lines are logged with their line number and skipped."""
+        fields = tuple(fields) if fields is not None else None
+        for line_no, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield self.codec.decode(line, self.record_type, fields)
+            except self.codec.decode_errors as e:
+                logger.warning(f"{getattr(file, 'name', '<stream>')}:{line_no}: skipping malformed line ({e})")
 
     def _write(self, file, lines):
         for line in lines:
@@ -61,6 +194,92 @@ class JSONLineReader(Reader):
             file.write('\n')
 
 
+class JSONLineWriter:
+    """
+    Keeps a .jsonl file open and writes lines in buffered chunks.
+
+    Every chunk is written with a single unbuffered write, so a crash can at most leave one partial
+    line at the end of the file. It is repaired when the file is opened for appending again.
+    """
+
+    def __init__(self, file, mode='a', buffer_size: int = 100, encoding="utf-8"):
+        self.file = file
+        self.mode = mode
+        self.buffer_size = buffer_size
+        self.enc = encoding
+        self.buffer = []
+        self.handle = None
+
+    def open(self):
+        if os.path.dirname(self.file):
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        if self.mode.startswith('a'):
+            self.repair(self.file)
+        self.handle = open(self.file, self.mode.replace('b', '') + 'b', buffering=0)
+        return self
+
+    @staticmethod
+    def repair(file) -> int:
+        """
+        Fix the end of a file whose last write was interrupted: a last line that parses is completed with
+        its missing newline, a fragment that does not is truncated. Returns the number of bytes removed.
+        """
+        if not os.path.isfile(file):
+            return 0
+        with open(file, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                chunk = f.read(end - start)
+                if start + len(chunk) == size and chunk.endswith(b'\n'):
+                    return 0
+                newline = chunk.rfind(b'\n')
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end == size:
+                return 0
+            f.seek(end)
+            try:
+                json.loads(f.read())
+            except ValueError:
+                f.truncate(end)
+                logger.warning(f"{file}: removed partial last line ({size - end} bytes)")
+                return size - end
+            f.write(b'\n')
+            logger.warning(f"{file}: added missing newline after the last line")
+            return 0
+
+    def write(self, line: dict):
+        """Queue one json object, flushing once the buffer is full."""
+        self.buffer.append(json.dumps(line, ensure_ascii=False))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            data = ('\n'.join(self.buffer) + '\n').encode(self.enc)
+            written = 0
+            while written < len(data):
+                written += self.handle.write(data[written:])
+            self.buffer = []
+
+    def close(self):
+        if self.handle is not None:
+            self.flush()
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class JSONReader(Reader):
     """Reader for .json files."""
 
@@ -0,0 +1,40 @@
+import re
+
+from config import PROJECT_DIR
+from data.loader import JSONLineReader
+
+CUSTOM_ID_PATTERN = re.compile(r"task-(.*)-(\d+)")
+
+
+class ResponseStore:
+    """
+    Resolves batch custom ids (task-<response_file>-<idx>) to the generated model outputs.
+
+    Every output file is parsed at most once and kept in memory, so lookups are O(1)
+    instead of re-reading the file for each judge result.
+    """
+
+    def __init__(self, base_dir: str = f'{PROJECT_DIR}/data/outputs/', reader: JSONLineReader = None):
+        self.base_dir = base_dir
+        self.reader = reader or JSONLineReader()
+        self.files = {}
+
+    @staticmethod
+    def parse_custom_id(custom_id: str) -> tuple[str, int]:
+        match = CUSTOM_ID_PATTERN.match(custom_id)
+        if not match:
+            raise ValueError(f"Invalid custom id: {custom_id}")
+        return match.group(1), int(match.group(2))
+
+    def get_file(self, response_file: str) -> list[dict]:
+        if response_file not in self.files:
+            self.files[response_file] = self.reader.read(self.base_dir + response_file) or []
+        return self.files[response_file]
+
+    def get(self, response_file: str, idx: int) -> dict:
+        return self.get_file(response_file)[idx]
+
+    def resolve(self, custom_id: str) -> tuple[str, int, dict]:
+        """Return (response_file, idx, response) for a custom id."""
+        response_file, idx = self.parse_custom_id(custom_id)
+        return response_file, idx, self.get(response_file, idx)
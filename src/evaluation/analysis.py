@@ -1,9 +1,13 @@
-from collections import Counter
+import hashlib
+import os
+import pickle
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from itertools import permutations
-from typing import Tuple
+from pathlib import Path
+from typing import Callable, Tuple
 
 import numpy as np
-from spacy.matcher.dependencymatcher import defaultdict
 
 from config import PROJECT_DIR
 from data.loader import JSONLineReader, JSONReader
@@ -16,33 +20,230 @@ from utils.lang_map import LANG_MAP
 from utils.models import MODELS
 from utils.modes import MODES
 
+JUDGED_DIR = f'{PROJECT_DIR}/data/judged_outputs'
+JUDGED_FILE = '{judged_dir}/{datatype}/{lang}/{model}/outputs-{datatype}-{lang}-{model}-{mode}-{permute}.jsonl'
+
+# Only these fields of a judged output are needed for the analysis.
+ANALYSIS_FIELDS = ('judge_response', 'entry')
+PARQUET_COLUMNS = ['lang', 'mode', 'permutation', 'row', 'question', 'positive_entities', 'negative_entity',
+                   'correctness', 'coarse_type', 'fine_category', 'mentioned_entities']
+DPO_TARGET_FILE = f'{PROJECT_DIR}/data/questions/questions-capableof-fly.json'
+ANALYSIS_CACHE_DIR = f'{PROJECT_DIR}/data/analysis_cache'
+# Inputs besides the judged outputs that a (cached) analysis depends on.
+EXTRA_INPUT_FILES = {'analyze_dpo': [DPO_TARGET_FILE]}
+
+
+def to_plain(obj):
+    """Recursively turn (default)dicts into plain dicts, so results can be pickled."""
+    if isinstance(obj, dict):
+        return {key: to_plain(value) for key, value in obj.items()}
+    if isinstance(obj, tuple):
+        return tuple(to_plain(value) for value in obj)
+    return obj
+
+
+def run_analysis_task(datatype: str, backend: str, parquet_dir: str, judged_dir: str, kind: str, model_id: str,
+                      lang: str = None):
+    """Process pool entry point: the per-language stats (or, for ablations, the full result) of one model."""
+    analysis = Analysis(datatype, backend=backend, parquet_dir=parquet_dir, judged_dir=judged_dir)
+    if kind == 'ablate_entity_position':
+        return to_plain(analysis._ablate_entity_position(model_id))
+    return to_plain(analysis.analyze_languages(model_id, [lang], dpo=kind == 'analyze_dpo'))[lang]
+
 
 class Analysis:
-    def __init__(self, datatype: str):
+    def __init__(self, datatype: str, backend: str = 'jsonl', parquet_dir: str = None, cache_dir: str = None,
+                 workers: int = None, judged_dir: str = JUDGED_DIR):
+        """
+        :param datatype: 'shared_ref' or 'clear_ref'.
+        :param backend: 'jsonl' reads data/judged_outputs, 'parquet' reads the columnar export
+                        (see data/columnar.py).
+        :param cache_dir: If given, per-model results are also pickled there (e.g. ANALYSIS_CACHE_DIR)
+                          and reused across runs. Results are always memoized in memory.
+        :param workers: Default number of processes for the *_all methods (None: run in this process).
+        :param judged_dir: Root of the judged outputs read by the jsonl backend.
+        """
+        if backend not in ('jsonl', 'parquet'):
+            raise ValueError(f"Invalid backend: {backend}")
         self.datatype = datatype
+        self.backend = backend
+        self.parquet_dir = parquet_dir
+        self.parquet_records = dict()
+        self.cache_dir = cache_dir
+        self.results = dict()
+        self.cache_stats = {'hits': 0, 'misses': 0}
+        self.workers = workers
+        self.judged_dir = judged_dir
+
+    def input_files(self, model_id: str) -> list[Path]:
+        """All judged output files a model's analysis reads."""
+        if self.backend == 'parquet':
+            from data.columnar import PARQUET_DIR
+
+            base_dir = Path(self.parquet_dir or PARQUET_DIR, f'datatype={self.datatype}')
+            return sorted(base_dir.glob(f'lang=*/model={model_id}/*.parquet'))
+        return sorted(Path(self.judged_dir, self.datatype).glob(f'*/{model_id}/*.jsonl'))
+
+    @staticmethod
+    def fingerprint(files: list[Path]) -> str:
+        """Hash of path, mtime and size of every file; changes whenever a file is added, removed or rewritten."""
+        digest = hashlib.sha256()
+        for file in files:
+            stat = file.stat()
+            digest.update(f'{file}:{stat.st_mtime_ns}:{stat.st_size}\n'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def cache_file(self, kind: str, model_id: str) -> Path | None:
+        if not self.cache_dir:
+            return None
+        return Path(self.cache_dir, f'{kind}-{self.datatype}-{self.backend}-{model_id}.pkl')
+
+    def lookup(self, kind: str, model_id: str) -> tuple[str, object]:
+        """Return (fingerprint of the current inputs, cached result or None if missing or outdated)."""
+        files = self.input_files(model_id) + [Path(f) for f in EXTRA_INPUT_FILES.get(kind, [])]
+        fingerprint = self.fingerprint(files)
+        cache_file = self.cache_file(kind, model_id)
+
+        entry = self.results.get((kind, model_id))
+        if entry is None and cache_file is not None and cache_file.is_file():
+            with open(cache_file, 'rb') as f:
+                entry = pickle.load(f)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            self.cache_stats['hits'] += 1
+            self.results[(kind, model_id)] = entry
+            return fingerprint, entry['result']
+
+        self.cache_stats['misses'] += 1
+        self.parquet_records.pop(model_id, None)
+        return fingerprint, None
+
+    def store(self, kind: str, model_id: str, fingerprint: str, result):
+        entry = {'fingerprint': fingerprint, 'result': to_plain(result)}
+        self.results[(kind, model_id)] = entry
+        cache_file = self.cache_file(kind, model_id)
+        if cache_file is not None:
+            os.makedirs(cache_file.parent, exist_ok=True)
+            tmp_file = cache_file.with_suffix('.tmp')
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(entry, f)
+            os.replace(tmp_file, cache_file)
+        return entry['result']
+
+    def cached(self, kind: str, model_id: str, compute: Callable):
+        """
+        Return the result of compute() for (kind, model), recomputing only if the model's input files changed.
+        Cached results are plain dicts shared between callers and must not be modified.
+        """
+        fingerprint, result = self.lookup(kind, model_id)
+        if result is None:
+            result = self.store(kind, model_id, fingerprint, compute())
+        return result
+
+    def analyze_models(self, kind: str, workers: int = None) -> dict:
+        """
+        Run kind ('analyze', 'analyze_dpo' or 'ablate_entity_position') for every model in MODELS.
+
+        With workers > 1, uncached models are computed in a process pool, split into one task per
+        (model, language) where possible. Results are merged in MODELS / LANG_MAP order, so they are
+        identical to a serial run.
+        """
+        workers = workers or self.workers
+        if not workers or workers <= 1:
+            return {model: getattr(self, kind)(model) for model in MODELS.keys()}
+
+        results, pending = dict(), dict()
+        for model in MODELS.keys():
+            fingerprint, result = self.lookup(kind, model)
+            if result is None:
+                pending[model] = fingerprint
+            else:
+                results[model] = result
+
+        langs = [None] if kind == 'ablate_entity_position' else list(LANG_MAP.keys())
+        tasks = [(model, lang) for model in pending for lang in langs]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(run_analysis_task, *zip(*[
+                (self.datatype, self.backend, self.parquet_dir, self.judged_dir, kind, model, lang) for model, lang in tasks
+            ]))) if tasks else []
+        outputs = dict(zip(tasks, outputs))
+
+        for model, fingerprint in pending.items():
+            if kind == 'ablate_entity_position':
+                result = outputs[(model, None)]
+            else:
+                stats = {lang: outputs[(model, lang)] for lang in langs}
+                result = (stats, self.summarize_dpo(stats) if kind == 'analyze_dpo' else self.summarize(stats))
+            results[model] = self.store(kind, model, fingerprint, result)
+        return {model: results[model] for model in MODELS.keys()}
+
+    def read_data(self, lang: str, model_id: str, permute: str = None) -> dict:
+        permute = permute or ("01" if self.datatype == 'clear_ref' else "012")
+        if self.backend == 'parquet':
+            records = self.read_parquet_records(model_id, [lang])
+            return {mode: records.get((lang, mode, permute), []) for mode in MODES.keys()}
 
-    def read_data(self, lang: str, base_file: str, model_id: str) -> dict:
-        permute = "01" if self.datatype == 'clear_ref' else "012"
         data = dict()
         for mode in MODES.keys():
-            model_data = JSONLineReader().read(base_file.format(datatype=self.datatype, lang=lang, model=model_id, mode=mode, permute=permute)) or []
-            data[mode] = model_data
+            file = JUDGED_FILE.format(judged_dir=self.judged_dir, datatype=self.datatype, lang=lang, model=model_id, mode=mode, permute=permute)
+            data[mode] = list(JSONLineReader().iter_read(file, fields=ANALYSIS_FIELDS))
         return data
 
-    def get_data(self, model_id: str) -> dict:
-        base_file = f'{PROJECT_DIR}/data/judged_outputs/' + '{datatype}/{lang}/{model}/outputs-{datatype}-{lang}-{model}-{mode}-{permute}.jsonl'
+    def read_parquet_records(self, model_id: str, langs: list[str] = None) -> dict:
+        """
+        Judged outputs of a model in langs (default: all) from the parquet export, grouped by
+        (lang, mode, permutation). The table is read once per model and kept until its files change.
+        """
+        langs = set(langs or LANG_MAP.keys())
+        loaded_langs, records = self.parquet_records.get(model_id, (set(), None))
+        if records is None or not langs <= loaded_langs:
+            from data.columnar import PARQUET_DIR, read_judged_table, to_response_records
+
+            table = read_judged_table(PARQUET_COLUMNS, self.parquet_dir or PARQUET_DIR, datatype=self.datatype,
+                                      model=model_id, lang=sorted(langs | loaded_langs))
+            table = table.sort_by([('lang', 'ascending'), ('mode', 'ascending'), ('permutation', 'ascending'),
+                                   ('row', 'ascending')])
+            keys = zip(*(table.column(name).to_pylist() for name in ('lang', 'mode', 'permutation')))
+            records = defaultdict(list)
+            for key, record in zip(keys, to_response_records(table)):
+                records[key].append(record)
+            self.parquet_records[model_id] = (langs | loaded_langs, records)
+        return records
+
+    def get_data(self, model_id: str, langs: list[str] = None) -> dict:
+        langs = langs or list(LANG_MAP.keys())
+        if self.backend == 'parquet':
+            self.read_parquet_records(model_id, langs)  # one read for all languages
         data = dict()
-        for lang in LANG_MAP.keys():
-            data[lang] = self.read_data(lang, base_file, model_id)
+        for lang in langs:
+            data[lang] = self.read_data(lang, model_id)
         return data
 
     def analyze(self, model_id: str) -> Tuple[dict, dict]:
-        responses = self.get_data(model_id)
+        return self.cached('analyze', model_id, lambda: self._analyze(model_id))
+
+    def _analyze(self, model_id: str) -> Tuple[dict, dict]:
+        stats = self.analyze_languages(model_id)
+        return stats, self.summarize(stats)
+
+    def analyze_languages(self, model_id: str, langs: list[str] = None, dpo: bool = False) -> dict:
+        """{lang: {mode: stats}} of a model. With dpo, questions of the DPO training target are excluded."""
+        responses = self.get_data(model_id, langs)
+        if dpo:
+            target_questions = JSONReader().read(DPO_TARGET_FILE).values()
+            responses = {
+                lang: {type_: [tr for tr in type_responses if tr['entry']['question'] not in target_questions]
+                       for type_, type_responses in lang_responses.items()}
+                for lang, lang_responses in responses.items()
+            }
+
         stats = defaultdict(dict)
         for lang, lang_responses in responses.items():
             for type_, type_responses in lang_responses.items():
                 stats[lang][type_] = self.analyze_responses(type_responses)
+        return stats
 
+    @staticmethod
+    def summarize(stats: dict) -> dict:
         summary_stats = defaultdict(lambda: defaultdict(float))
         variances = defaultdict(lambda: defaultdict(list))
         for lang, lang_stats in stats.items():
@@ -63,7 +264,7 @@ class Analysis:
             for k2, v2 in v1.items():
                 summary_stats[k1][k2] = v2 / 5
         summary_stats['variances'] = variances
-        return stats, summary_stats
+        return summary_stats
 
     @staticmethod
     def compute_percentages(sub: dict) -> dict:
@@ -75,48 +276,53 @@ class Analysis:
 
     def analyze_responses(self, responses: list[dict], permutation: str = "012") -> dict:
         judge_responses = [r['judge_response'] for r in responses]
-
-        correct_counter = Counter(r['correctness'] for r in judge_responses)
-        coarse_counter = Counter(r['coarse_type'] for r in judge_responses)
-        fine_counter = Counter(r['fine_category'] for r in judge_responses)
         total_counter = Counter((r['coarse_type'], r['fine_category'], r['correctness']) for r in judge_responses)
 
-        correct_coarse_counter = Counter((r['coarse_type']) for r in judge_responses if r['correctness'] == 'Correct')
-        direct_coarse_counter = Counter((r['coarse_type']) for r in judge_responses if r['fine_category'] == 'Direct')
-
-        entity_total = defaultdict(int)
-        entity_correct = defaultdict(int)
-        entity_partial = defaultdict(int)
-        entity_wrong = defaultdict(int)
-
-        pos_total = defaultdict(int)
-        pos_correct = defaultdict(int)
-        pos_partial = defaultdict(int)
-        pos_wrong = defaultdict(int)
+        counters = {name: defaultdict(int) for name in (
+            'correct', 'coarse_type', 'fine_category', 'correct_coarse', 'direct_coarse')}
+        for (coarse_type, fine_category, correctness), count in total_counter.items():
+            counters['correct'][correctness] += count
+            counters['coarse_type'][coarse_type] += count
+            counters['fine_category'][fine_category] += count
+            if correctness == 'Correct':
+                counters['correct_coarse'][coarse_type] += count
+            if fine_category == 'Direct':
+                counters['direct_coarse'][coarse_type] += count
+        counters['total'] = total_counter
+
+        correctness_keys = {'Correct': 'correct', 'Partially Correct': 'partial', 'Wrong': 'wrong'}
+        for name in ('total', 'correct', 'partial', 'wrong'):
+            counters[f'entity_{name}'] = defaultdict(int)
+            counters[f'pos_{name}'] = defaultdict(int)
 
         for response, judge in zip(responses, judge_responses):
-            pos_entities = [e['entity'] for e in response['entry']['positive']]  # [pos_0, pos_1]
-            neg_entity = response['entry']['negative']['entity']
+            entities = [e['entity'] for e in response['entry']['positive']] + [response['entry']['negative']['entity']]
             mentioned = judge['mentioned_entities']
+            correctness = correctness_keys.get(judge['correctness'])
 
-            for idx, entity in enumerate(pos_entities + [neg_entity]):
+            for idx, entity in enumerate(entities):  # [pos_0, pos_1, neg]
                 entity_key = f'entity_{idx}'
+                pos_key = f'pos_{permutation.index(str(idx))}'
                 is_mentioned = int(entity in mentioned)
 
-                pos_idx = permutation.index(str(idx))
-                pos_key = f'pos_{pos_idx}'
-
-                entity_total[entity_key] += is_mentioned
-                pos_total[pos_key] += is_mentioned
-                if judge['correctness'] == 'Correct':
-                    entity_correct[entity_key] += is_mentioned
-                    pos_correct[pos_key] += is_mentioned
-                elif judge['correctness'] == 'Partially Correct':
-                    entity_partial[entity_key] += is_mentioned
-                    pos_partial[pos_key] += is_mentioned
-                elif judge['correctness'] == 'Wrong':
-                    entity_wrong[entity_key] += is_mentioned
-                    pos_wrong[pos_key] += is_mentioned
+                counters['entity_total'][entity_key] += is_mentioned
+                counters['pos_total'][pos_key] += is_mentioned
+                if correctness is not None:
+                    counters[f'entity_{correctness}'][entity_key] += is_mentioned
+                    counters[f'pos_{correctness}'][pos_key] += is_mentioned
+        return self.build_stats(counters)
+
+    def build_stats(self, counters: dict) -> dict:
+        correct_counter = counters['correct']
+        coarse_counter = counters['coarse_type']
+        fine_counter = counters['fine_category']
+        correct_coarse_counter = counters['correct_coarse']
+        direct_coarse_counter = counters['direct_coarse']
+        total_counter = counters['total']
+        entity_total, entity_correct = counters['entity_total'], counters['entity_correct']
+        entity_partial, entity_wrong = counters['entity_partial'], counters['entity_wrong']
+        pos_total, pos_correct = counters['pos_total'], counters['pos_correct']
+        pos_partial, pos_wrong = counters['pos_partial'], counters['pos_wrong']
 
         return {
             'correct': {
@@ -174,6 +380,9 @@ class Analysis:
         }
 
     def ablate_entity_position(self, model_id: str) -> Tuple[dict, dict, dict, dict]:
+        return self.cached('ablate_entity_position', model_id, lambda: self._ablate_entity_position(model_id))
+
+    def _ablate_entity_position(self, model_id: str) -> Tuple[dict, dict, dict, dict]:
         data = dict()
         aggregated = {
             'en': {
@@ -183,8 +392,7 @@ class Analysis:
         }
         for permutation in permutations([0, 1, 2] if self.datatype == 'shared_ref' else [0, 1]):
             permutation_str = ''.join(list([str(n) for n in permutation]))
-            base_file = f'{PROJECT_DIR}/data/judged_outputs/' + '{datatype}/{lang}/{model}/outputs-{datatype}-{lang}-{model}-{mode}-' + f'{permutation_str}.jsonl'
-            perm_data = self.read_data(lang='en', base_file=base_file, model_id=model_id)
+            perm_data = self.read_data(lang='en', model_id=model_id, permute=permutation_str)
             data[permutation_str] = perm_data
             aggregated['en']['simple'].extend(perm_data['simple'])
             aggregated['en']['normal'].extend(perm_data['normal'])
@@ -231,11 +439,10 @@ class Analysis:
                 }
         return total_stats, percentage_entity_stats, percentage_pos_stats, aggregated
 
-    def analyze_all(self) -> dict:
+    def analyze_all(self, workers: int = None) -> dict:
         data = dict()
         lang_stats = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
-        for model in MODELS.keys():
-            general_stats, summary_stats = self.analyze(model_id=model)
+        for model, (general_stats, summary_stats) in self.analyze_models('analyze', workers).items():
             data[model] = {'general_stats': general_stats, 'summary_stats': summary_stats}
             for lang, stats in general_stats.items():
                 for type_, type_stats in stats.items():
@@ -255,11 +462,11 @@ class Analysis:
 
         return data
 
-    def ablate_entity_position_all(self) -> dict:
+    def ablate_entity_position_all(self, workers: int = None) -> dict:
         data = dict()
         aggregated = defaultdict(dict)
-        for model in MODELS.keys():
-            stats, entity_stats, pos_stats, aggregated_stats = self.ablate_entity_position(model_id=model)
+        for model, result in self.analyze_models('ablate_entity_position', workers).items():
+            stats, entity_stats, pos_stats, aggregated_stats = result
             data[model] = {'stats': stats, 'entity_stats': entity_stats, 'pos_stats': pos_stats, 'aggregated_stats': aggregated_stats}
             aggregated[model]['general_stats'] = aggregated_stats
         #simple_df = pd.DataFrame(
@@ -295,9 +502,9 @@ class Analysis:
 
             stats = model_data['general_stats']
             for lang, lang_stats in stats.items():
-                lang_data[lang][model]['Simple']['value'] = lang_stats['simple']['correct']['percentage']['Correct']
+                lang_data[lang][model]['Simple']['value'] = lang_stats['simple']['correct']['percentage'].get('Correct', 0)
                 lang_data[lang][model]['Simple']['direct'] = lang_stats['simple']['fine_category']['percentage'].get('Direct', 0)
-                lang_data[lang][model]['Normal']['value'] = lang_stats['normal']['correct']['percentage']['Correct']
+                lang_data[lang][model]['Normal']['value'] = lang_stats['normal']['correct']['percentage'].get('Correct', 0)
                 lang_data[lang][model]['Normal']['direct'] = lang_stats['normal']['fine_category']['percentage'].get('Direct', 0)
         base_file = self.datatype + '_correct_predictions'
 
@@ -340,24 +547,19 @@ class Analysis:
         generate_cats_graphs(lang_data, base_file='direct_cats_{lang}')
 
     def analyze_dpo(self, model_id: str) -> tuple[dict, dict]:
-        TARGET_QUESTION = JSONReader().read(f'{PROJECT_DIR}/data/questions/questions-capableof-fly.json').values()
+        return self.cached('analyze_dpo', model_id, lambda: self._analyze_dpo(model_id))
 
-        responses = self.get_data(model_id)
-        filtered_responses = defaultdict(dict)
-        for lang, lang_responses in responses.items():
-            for type_, type_responses in lang_responses.items():
-                filtered_responses[lang][type_] = [tr for tr in type_responses if tr['entry']['question'] not in TARGET_QUESTION]
-
-        stats = defaultdict(dict)
-        for mode, langs in filtered_responses.items():
-            for lang, lang_responses in langs.items():
-                stats[mode][lang] = self.analyze_responses(lang_responses)
+    def _analyze_dpo(self, model_id: str) -> tuple[dict, dict]:
+        stats = self.analyze_languages(model_id, dpo=True)
+        return stats, self.summarize_dpo(stats)
 
+    @staticmethod
+    def summarize_dpo(stats: dict) -> dict:
         summary_stats = defaultdict(lambda: defaultdict(float))
         for lang, lang_stats in stats.items():
             for type_, type_responses in lang_stats.items():
-                summary_stats['correct'][type_] += type_responses['correct']['percentage']['Correct']
-                summary_stats['correct_direct'][type_] += type_responses['fine_category']['count']['Direct'] / type_responses['correct']['count']['Correct'] * 100
+                summary_stats['correct'][type_] += type_responses['correct']['percentage'].get('Correct', 0)
+                summary_stats['correct_direct'][type_] += type_responses['fine_category']['count'].get('Direct', 0) / type_responses['correct']['count'].get('Correct', 1) * 100
 
                 for category, category_stats in type_responses['coarse_type']['percentage'].items():
                     summary_stats[category][type_] += category_stats
@@ -365,12 +567,11 @@ class Analysis:
         for k1, v1 in summary_stats.items():
             for k2, v2 in v1.items():
                 summary_stats[k1][k2] = v2 / 5
-        return stats, summary_stats
+        return summary_stats
 
-    def analyze_dpo_all(self):
+    def analyze_dpo_all(self, workers: int = None):
         data = dict()
-        for model in MODELS.keys():
-            general_stats, summary_stats = self.analyze_dpo(model_id=model)
+        for model, (general_stats, summary_stats) in self.analyze_models('analyze_dpo', workers).items():
             data[model] = {'general_stats': general_stats, 'summary_stats': summary_stats}
         return data
 
@@ -3,8 +3,9 @@ from datetime import datetime
 from config import PROJECT_DIR
 from data.loader import JSONLineReader
 from evaluation.judge import Judge
-from utils.openai_client import create_batch_job
+from utils.batch_manager import BatchManager
 
+OUTPUTS_DIR = f'{PROJECT_DIR}/data/outputs/'
 SPLITS = ['shared_ref']
 MODES = ['cot_normal', 'cot_simple']
 LANGS = ['en']
@@ -19,61 +20,69 @@ for split in SPLITS:
                 for order in ORDERS:
                     if order != [0, 1] and lang != 'en':
                         continue
-                    file = f'{split}/{lang}/{model}/outputs-{split}-{lang}-{model}-{mode}-{''.join([str(o) for o in order])}.jsonl'
+                    file = f'{split}/{lang}/{model}/outputs-{split}-{lang}-{model}-{mode}-{"".join([str(o) for o in order])}.jsonl'
                     RESPONSE_FILES.append(file)
 
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 JUDGE_FILE = f'{PROJECT_DIR}/data/judge-inputs/coarse-judge-input-{timestamp}.jsonl'
-reader = JSONLineReader()
+OUTPUT_FILE = f'{PROJECT_DIR}/data/raw_judge_outputs/coarse-batch-{timestamp}.jsonl'
 
-tasks = []
-for response_file in RESPONSE_FILES:
-    responses = reader.read(f'{PROJECT_DIR}/data/outputs/' + response_file)
-    for idx, response in enumerate(responses):
-        answer = response.get('answer')
-        if 'Response: ' in answer:
-            answer = answer.split('Response: ')[1]
-        else:
-            print('no response found.')
-        question = response.get('entry').get('question')
-        task = {
-            "custom_id": f"task-{response_file}-{idx}",
-            "method": "POST",
-            "url": '/v1/responses',
-            "body": {
-                "model": "gpt-4.1-mini-2025-04-14",
-                "temperature": 0,
-                "input": Judge.get_coarse_type_instructions(question, answer),
-                "text": {
-                    "format": {
-                        "type": "json_schema",
-                        "name": "ResponseCategory",
-                        "schema": {
-                            "type": "object",
-                            "properties": {
-                                "explanation": {
-                                    "type": "string",
-                                },
-                                "category": {
-                                  "type": "string",
-                                  "enum": [
-                                    "refuse",
-                                    "missing",
-                                    "answer_attempt",
-                                    "hedge",
-                                    "clarification",
-                                  ]
+
+def build_coarse_judge_tasks(response_files: list[str], outputs_dir: str = OUTPUTS_DIR) -> list[dict]:
+    """Batch requests asking the judge for the coarse response category of each response."""
+    reader = JSONLineReader()
+    tasks = []
+    for response_file in response_files:
+        responses = reader.read(outputs_dir + response_file)
+        for idx, response in enumerate(responses):
+            answer = response.get('answer')
+            if 'Response: ' in answer:
+                answer = answer.split('Response: ')[1]
+            else:
+                print('no response found.')
+            question = response.get('entry').get('question')
+            task = {
+                "custom_id": f"task-{response_file}-{idx}",
+                "method": "POST",
+                "url": '/v1/responses',
+                "body": {
+                    "model": "gpt-4.1-mini-2025-04-14",
+                    "temperature": 0,
+                    "input": Judge.get_coarse_type_instructions(question, answer),
+                    "text": {
+                        "format": {
+                            "type": "json_schema",
+                            "name": "ResponseCategory",
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "explanation": {
+                                        "type": "string",
+                                    },
+                                    "category": {
+                                      "type": "string",
+                                      "enum": [
+                                        "refuse",
+                                        "missing",
+                                        "answer_attempt",
+                                        "hedge",
+                                        "clarification",
+                                      ]
+                                    },
                                 },
+                                "required": ["explanation", "category"],
+                                "additionalProperties": False
                             },
-                            "required": ["explanation", "category"],
-                            "additionalProperties": False
-                        },
-                        "strict": True
+                            "strict": True
+                        }
                     }
                 }
             }
-        }
-        tasks.append(task)
+            tasks.append(task)
+    return tasks
+
 
-JSONLineReader().write(JUDGE_FILE, tasks)
-create_batch_job(JUDGE_FILE, endpoint='/v1/responses')
+if __name__ == '__main__':
+    JSONLineReader().write(JUDGE_FILE, build_coarse_judge_tasks(RESPONSE_FILES))
+    # Blocks until all shards are done; resume an interrupted run with utils/batch_manager.py data/batch_jobs/<OUTPUT_FILE name>.state.json
+    BatchManager(JUDGE_FILE, OUTPUT_FILE, endpoint='/v1/responses').run()
@@ -1,11 +1,10 @@
 from itertools import permutations
 
 from datasets import load_dataset
-from tqdm import tqdm
 
 from config import PROJECT_DIR
 from conversation.builder import ConversationBuilder
-from data.loader import JSONLineReader
+from conversation.engine import GenerationEngine
 from utils.lang_map import LANG_MAP
 from utils.modes import MODES
 
@@ -14,8 +13,13 @@ model_path = 'gpt-4o-2024-08-06' #'gpt-4o-2024-08-06' #'accounts/fireworks/model
 provider = 'openai' #'openrouter' #'openai' #'fireworks'
 split = 'shared_ref' #'shared_ref' # choose 'shared_ref', 'clear_ref'
 orders = list(range(2) if split == 'clear_ref' else range(3))
+concurrency = None # max. parallel requests, defaults to utils/concurrency.PROVIDER_CONCURRENCY
+resume = True # skip dataset rows that already have an output, so an interrupted run continues where it stopped
 
 datadict = load_dataset('lukasellinger/itdepends')
+engine = GenerationEngine(concurrency=concurrency, resume=resume)
+
+jobs = []
 
 for lang in ['en']: #LANG_MAP.keys():
     for mode in ['cot_normal', 'cot_simple']:
@@ -26,7 +30,7 @@ for lang in ['en']: #LANG_MAP.keys():
             #    continue
             output_file = f'{PROJECT_DIR}/data/outputs/{split}/{lang}/{model}/outputs-{split}-{lang}-{model}-{mode}-{''.join([str(o) for o in order])}.jsonl'
             conv_builder = ConversationBuilder(provider=provider, model=model_path, mode=mode, order=order, lang=lang)
+            jobs.append((conv_builder, dataset, output_file))
 
-            for entry in tqdm(dataset):
-                output = conv_builder.generate_answer(entry)
-                JSONLineReader().write(output_file, [{**output, 'entry': entry}])
+engine.generate_all(jobs)
+engine.close()
@@ -3,8 +3,9 @@ from typing import Tuple, Literal
 
 from pydantic import BaseModel
 
+from utils.entity_matcher import ABSENT, FOUND, UNDECIDED, EntityMatcher
 from utils.openai_client import prompt_chat_structured
-from utils.spacy_utils import force_noun_lemmatization, lemmatize_text, stem_sentence, stem_word
+from utils.spacy_utils import force_noun_lemmatization, lemmatize_text, lemmatize_texts, stem_sentence, stem_word
 
 
 class DataType(Enum):
@@ -170,9 +171,13 @@ class Judge:
     def judge_response(self, response: dict) -> dict:
         input_entities = [e['entity'] for e in response.get('entry').get('positive')] + [response.get('entry').get('negative')['entity']]
         entities, _ = self.get_mentioned_entities(input_entities, response['answer'])
-        mentioned_entities = self.process_mentioned_entities(entities, response['entry'])
         coarse_type, _ = self.get_coarse_type(response.get('entry').get('question'), response.get('answer'))
-        fine_category, correctness = self.get_fine_category(coarse_type, mentioned_entities['pos_count'], mentioned_entities['neg_count'])
+        return self.build_judge_response(coarse_type, entities, response['entry'])
+
+    def build_judge_response(self, coarse_type: str, entities: list[str], entry: dict) -> dict:
+        """judge_response record from the coarse type and the mentioned entities returned by the judge model."""
+        mentioned_entities = self.process_mentioned_entities(entities, entry)
+        fine_category, correctness = self.get_fine_category(coarse_type, mentioned_entities['pos_found'], mentioned_entities['neg_found'])
         return {
             "correctness": correctness,
             "coarse_type": coarse_type,
@@ -180,6 +185,13 @@ class Judge:
             **mentioned_entities
         }
 
+    @staticmethod
+    def extract_final_answer(answer: str) -> str:
+        """Strip the reasoning of cot answers ('... Response: <answer>'), as the batch judge inputs do."""
+        if 'Response: ' in answer:
+            return answer.split('Response: ')[1]
+        return answer
+
     def get_fine_category(self, coarse_type: str, pos_count: int, neg_count: int) -> Tuple[str, str]:
         lookup_dict = CLEAR_REF_CATEGORY_DICT if self.data_type == DataType.CLEAR_REF else SHARED_REF_CATEGORY_DICT
         category_dict = lookup_dict.get(coarse_type, {})
@@ -335,30 +347,115 @@ Be strict. Only use 'hedging' when the response **explicitly confirms** the refe
             'mentioned_entities': mentioned_entities
         }
 
-    def get_rule_based_counts(self, response: dict) -> Tuple[int, int, list[str]]:
-        pos_entities = [
-            force_noun_lemmatization(pos['entity'])
-            for pos in response['entry']['positive']
-        ]
-        neg_entity = force_noun_lemmatization(response['entry']['negative']['entity'])
+    @staticmethod
+    def normalize_entity(entity: str) -> Tuple[str, str]:
+        """(noun lemma, stem of the lemma) of an entity."""
+        lemma = force_noun_lemmatization(entity)
+        return lemma, stem_word(lemma)
+
+    def get_rule_based_counts(self, response: dict, answer_lemmas: set = None,
+                              normalized_entities: dict = None) -> Tuple[int, int, list[str]]:
+        """
+        :param answer_lemmas: Precomputed lemmatize_text(response['answer']).
+        :param normalized_entities: entity -> normalize_entity(entity), filled on the fly and
+                                    shared across calls so each entity is processed once.
+        """
+        if normalized_entities is None:
+            normalized_entities = dict()
+
+        def normalize(entity: str) -> Tuple[str, str]:
+            if entity not in normalized_entities:
+                normalized_entities[entity] = self.normalize_entity(entity)
+            return normalized_entities[entity]
+
+        pos_entities = [normalize(pos['entity']) for pos in response['entry']['positive']]
+        neg_entity, neg_stem = normalize(response['entry']['negative']['entity'])
 
         answer = response['answer']
-        answer_lemmas = lemmatize_text(answer)
+        if answer_lemmas is None:
+            answer_lemmas = lemmatize_text(answer)
 
-        pos_found = {e for e in pos_entities if e in answer_lemmas}
+        pos_found = {e for e, _ in pos_entities if e in answer_lemmas}
         neg_found = (neg_entity in answer_lemmas)
 
         stemmed_answer_set = stem_sentence(answer)
-        pos_found = pos_found.union({e for e in pos_entities if stem_word(e) in stemmed_answer_set})
-        neg_found = neg_found or stem_word(neg_entity) in stemmed_answer_set
+        pos_found = pos_found.union({e for e, stem in pos_entities if stem in stemmed_answer_set})
+        neg_found = neg_found or neg_stem in stemmed_answer_set
 
         return len(pos_found), int(neg_found), list(pos_found)
 
-    def rerun_rule_based(self, responses: list[dict]):
-        for response in responses:
+    def get_matched_counts(self, response: dict, matches: dict, lang: str = 'en', answer_lemmas: set = None,
+                           normalized_entities: dict = None) -> Tuple[int, int, list[str]]:
+        """
+        Rule-based counts from EntityMatcher.match results. English entities the matcher cannot decide
+        (see needs_spacy) are checked with the spaCy lemma/stem rules (answer_lemmas are needed then);
+        for other languages, where no lemmatizer is set up, a match at a word start is counted.
+        """
+        if normalized_entities is None:
+            normalized_entities = dict()
+        answer_stems = None
+
+        def normalize(entity: str) -> Tuple[str, str]:
+            if entity not in normalized_entities:
+                normalized_entities[entity] = self.normalize_entity(entity)
+            return normalized_entities[entity]
+
+        def is_found(entity: str) -> bool:
+            nonlocal answer_stems
+            status = matches[entity.lower()]
+            if self.needs_spacy(entity, status, lang):
+                lemma, stem = normalize(entity)
+                if lemma in answer_lemmas:
+                    return True
+                if answer_stems is None:
+                    answer_stems = stem_sentence(response['answer'])
+                return stem in answer_stems
+            return status != ABSENT
+
+        # Lemmas, de-duplicated, as stored by get_rule_based_counts.
+        pos_found = list(dict.fromkeys(normalize(pos['entity'])[0] for pos in response['entry']['positive']
+                                       if is_found(pos['entity'])))
+        neg_found = is_found(response['entry']['negative']['entity'])
+        return len(pos_found), int(neg_found), pos_found
+
+    @staticmethod
+    def needs_spacy(entity: str, status: str, lang: str) -> bool:
+        """
+        Whether an EntityMatcher status is decided by the spaCy lemma/stem rules: English UNDECIDED matches,
+        and English multi-word matches, since those rules compare single tokens.
+        """
+        return lang == 'en' and (status == UNDECIDED or (status == FOUND and ' ' in entity.strip()))
+
+    def rerun_rule_based(self, responses: list[dict], batch_size: int = 64, n_process: int = 1,
+                         lang: str = 'en', matcher: EntityMatcher = None):
+        """
+        Re-judge responses in place with the rule-based entity matching. Answers are lemmatized in
+        batches through nlp.pipe (n_process > 1 uses several processes), entities once per unique entity.
+
+        With a matcher (EntityMatcher.from_contexts()), entities are first looked up in a single pass over
+        each answer, which also works for non-English answers; only English answers with undecided
+        entities are lemmatized.
+        """
+        lookup_dict = CLEAR_REF_CATEGORY_DICT if self.data_type == DataType.CLEAR_REF else SHARED_REF_CATEGORY_DICT
+        normalized_entities = dict()
+        if matcher is None:
+            answer_lemmas = lemmatize_texts((r['answer'] for r in responses), batch_size=batch_size, n_process=n_process)
+            counts = (self.get_rule_based_counts(response, lemmas, normalized_entities)
+                      for response, lemmas in zip(responses, answer_lemmas))
+        else:
+            matches = [
+                matcher.match(r['answer'], [e['entity'] for e in r['entry']['positive']] + [r['entry']['negative']['entity']], lang)
+                for r in responses
+            ]
+            undecided = [i for i, m in enumerate(matches)
+                         if any(self.needs_spacy(entity, status, lang) for entity, status in m.items())]
+            answer_lemmas = dict(zip(undecided, lemmatize_texts((responses[i]['answer'] for i in undecided),
+                                                                batch_size=batch_size, n_process=n_process)))
+            counts = (self.get_matched_counts(response, matches[i], lang, answer_lemmas.get(i), normalized_entities)
+                      for i, response in enumerate(responses))
+
+        for response, (pos_count, neg_count, pos) in zip(responses, counts):
             coarse_type = response.get('judge_response').get('coarse_type')
-            pos_count, neg_count, pos = self.get_rule_based_counts(response)
-            lookup_dict = CLEAR_REF_CATEGORY_DICT if self.data_type == DataType.CLEAR_REF else SHARED_REF_CATEGORY_DICT
             category_dict = lookup_dict.get(coarse_type, {})
 
             fine_category, correctness = category_dict.get(pos_count, {}).get(neg_count, ("Unknown", "Error"))
@@ -371,7 +468,6 @@ Be strict. Only use 'hedging' when the response **explicitly confirms** the refe
                 "pos": pos,
             }
 
-
 if __name__ == '__main__':
     judge = Judge('shared_ref')
     #file = f'{PROJECT_DIR}/data/outputs/outputs-shared_ref-think-gpt-4o.jsonl'
@@ -0,0 +1,94 @@
+"""
+Judge model outputs with concurrent realtime API calls instead of the 24h Batch API.
+
+Produces the same data/judged_outputs records as batched_entity_judge.py + batched_coarse_judge.py
++ batched_judge_parse.py, which makes it the faster route for small or urgent re-judges.
+"""
+import asyncio
+
+from tqdm import tqdm
+
+from config import PROJECT_DIR
+from data.loader import JSONLineReader, JSONLineWriter
+from evaluation.judge import Judge
+from utils.concurrency import CallPool, amap_ordered, get_concurrency
+
+
+class RealtimeJudge:
+    """
+    Runs Judge.get_mentioned_entities and Judge.get_coarse_type concurrently, both per response and
+    across responses, with at most `concurrency` requests in flight.
+    """
+
+    def __init__(self, judge: Judge, concurrency: int = None):
+        self.judge = judge
+        self.pool = CallPool(concurrency or get_concurrency('openai'))
+
+    async def ajudge(self, response: dict) -> dict | None:
+        """The judge_response of one model output, or None if a judge call failed."""
+        entry = response['entry']
+        answer = Judge.extract_final_answer(response['answer'])
+        input_entities = [e['entity'] for e in entry['positive']] + [entry['negative']['entity']]
+        try:
+            (entities, _), (coarse_type, _) = await asyncio.gather(
+                self.pool.run(self.judge.get_mentioned_entities, input_entities, answer),
+                self.pool.run(self.judge.get_coarse_type, entry['question'], answer),
+            )
+        except Exception as e:
+            print(f'Could not judge response - {e}')
+            return None
+        return self.judge.build_judge_response(coarse_type, entities, entry)
+
+    async def ajudge_file(self, input_file: str, output_file: str) -> tuple[int, int]:
+        """Judge all responses of input_file into output_file (in input order). Returns (judged, failed)."""
+        responses = JSONLineReader().iter_read(input_file)
+        judged, failed = 0, 0
+        with JSONLineWriter(output_file, mode='w') as writer:
+            progress = tqdm(desc=input_file.rsplit('/', 1)[-1], leave=False)
+            async for response, judge_response in amap_ordered(self.ajudge, responses, self.pool.concurrency):
+                progress.update()
+                if judge_response is None:
+                    failed += 1
+                    continue
+                writer.write({"judge_response": judge_response, **response})
+                judged += 1
+            progress.close()
+        return judged, failed
+
+    def judge_files(self, files: list[tuple[str, str]]) -> list[tuple[int, int]]:
+        """Judge several (input_file, output_file) pairs at once, sharing the request pool."""
+        async def run():
+            return await asyncio.gather(*[self.ajudge_file(*file) for file in files])
+        return asyncio.run(run())
+
+    def close(self):
+        self.pool.close()
+
+
+if __name__ == '__main__':
+    SPLITS = ['shared_ref']
+    MODES = ['cot_normal', 'cot_simple']
+    LANGS = ['en']
+    MODELS = ['gpt-4o']  # ['gpt-4o-mini', 'gpt-4o', 'deepseek-v3', 'qwen3-32b', 'llama-8b']
+    ORDERS = [[0, 1, 2]]  # , [1, 2, 0], [0, 2, 1], [2, 1, 0], [2, 0, 1]]
+    JUDGE_MODEL = 'gpt-4.1-mini-2025-04-14'  # same judge as the batch inputs
+    concurrency = None  # None: per-provider default from utils/concurrency.py
+
+    RESPONSE_FILES = []
+    for split in SPLITS:
+        for mode in MODES:
+            for lang in LANGS:
+                for model in MODELS:
+                    for order in ORDERS:
+                        if order != [0, 1] and lang != 'en':
+                            continue
+                        order_str = ''.join([str(o) for o in order])
+                        RESPONSE_FILES.append(f'{split}/{lang}/{model}/outputs-{split}-{lang}-{model}-{mode}-{order_str}.jsonl')
+
+    runner = RealtimeJudge(Judge(data_type=SPLITS[0], model=JUDGE_MODEL), concurrency=concurrency)
+    results = runner.judge_files([
+        (f'{PROJECT_DIR}/data/outputs/{file}', f'{PROJECT_DIR}/data/judged_outputs/{file}') for file in RESPONSE_FILES
+    ])
+    runner.close()
+    for file, (judged, failed) in zip(RESPONSE_FILES, results):
+        print(f'{file}: {judged} judged, {failed} failed')
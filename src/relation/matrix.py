@@ -0,0 +1,152 @@
+"""
+Precomputed entity x relation compatibility matrix for negative sampling.
+
+For every entity of data/contexts and every relation of data/relationships.json, the matrix holds
+whether the entity satisfies the relation (and which cells are known). It is filled with batched
+judge calls through RelationVerifier, so only missing cells (e.g. the column of a new relation)
+are ever asked, and stored as MATRIX_FILE next to data/relationships.json.
+
+Run `python relation/matrix.py` to create or update it (build_dataset.py does so itself with SAMPLING = 'matrix').
+"""
+import os
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from config import PROJECT_DIR
+from data.loader import JSONLineReader, JSONReader
+from relation.negatives import relation_of
+from relation.verifier import RelationVerifier
+
+MATRIX_FILE = f'{PROJECT_DIR}/data/relation_matrix.npz'
+RELATIONSHIPS_FILE = f'{PROJECT_DIR}/data/relationships.json'
+CONTEXTS_DIR = f'{PROJECT_DIR}/data/contexts'
+
+
+class RelationMatrix:
+    def __init__(self, entities: list[str] = None, relations: list[str] = None, satisfies: np.ndarray = None,
+                 known: np.ndarray = None):
+        self.entities = list(entities or [])
+        self.relations = list(relations or [])
+        shape = (len(self.entities), len(self.relations))
+        self.satisfies = satisfies if satisfies is not None else np.zeros(shape, dtype=bool)
+        self.known = known if known is not None else np.zeros(shape, dtype=bool)
+        self.build_index()
+
+    def build_index(self):
+        self.entity_index = {entity: i for i, entity in enumerate(self.entities)}
+        self.relation_index = {relation: j for j, relation in enumerate(self.relations)}
+
+    @classmethod
+    def load(cls, path: str = MATRIX_FILE) -> 'RelationMatrix':
+        """The stored matrix, or an empty one if path does not exist."""
+        if not os.path.isfile(path):
+            return cls()
+        with np.load(path) as data:
+            return cls(data['entities'].tolist(), data['relations'].tolist(),
+                       np.unpackbits(data['satisfies'], axis=1, count=len(data['relations'])).astype(bool),
+                       np.unpackbits(data['known'], axis=1, count=len(data['relations'])).astype(bool))
+
+    def save(self, path: str = MATRIX_FILE):
+        tmp_file = f'{path}.tmp.npz'
+        np.savez_compressed(tmp_file, entities=np.array(self.entities, dtype=str),
+                            relations=np.array(self.relations, dtype=str),
+                            satisfies=np.packbits(self.satisfies, axis=1), known=np.packbits(self.known, axis=1))
+        os.replace(tmp_file, path)
+
+    def extend(self, entities: list[str] = (), relations: list[str] = ()):
+        """Add rows / columns (all unknown) for entities and relations that are not in the matrix yet."""
+        new_entities = [e for e in dict.fromkeys(entities) if e not in self.entity_index]
+        new_relations = [r for r in dict.fromkeys(relations) if r not in self.relation_index]
+        if not new_entities and not new_relations:
+            return
+        shape = (len(self.entities) + len(new_entities), len(self.relations) + len(new_relations))
+        satisfies, known = np.zeros(shape, dtype=bool), np.zeros(shape, dtype=bool)
+        satisfies[:len(self.entities), :len(self.relations)] = self.satisfies
+        known[:len(self.entities), :len(self.relations)] = self.known
+        self.entities += new_entities
+        self.relations += new_relations
+        self.satisfies, self.known = satisfies, known
+        self.build_index()
+
+    def fill(self, verifier: RelationVerifier) -> int:
+        """Verify all unknown cells (in one concurrent batch). Returns the number of cells filled."""
+        rows, cols = np.nonzero(~self.known)
+        pairs = [(self.entities[i], self.relations[j]) for i, j in zip(rows, cols)]
+        verifier.verify(pairs)
+        for i, j, (entity, relation) in zip(rows, cols, pairs):
+            self.satisfies[i, j] = verifier.get(entity, relation)
+            self.known[i, j] = True
+        return len(pairs)
+
+    def get(self, entity: str, relation: str) -> bool | None:
+        """Verdict of a cell, or None if it is unknown (same interface as RelationVerifier)."""
+        i, j = self.entity_index.get(entity), self.relation_index.get(relation)
+        if i is None or j is None or not self.known[i, j]:
+            return None
+        return bool(self.satisfies[i, j])
+
+    def verify(self, pairs):
+        missing = [pair for pair in pairs if self.get(*pair) is None]
+        if missing:
+            raise ValueError(f"{len(missing)} (entity, relation) pairs are not in the relation matrix, e.g. "
+                             f"{missing[0]}. Update it with `python relation/matrix.py`.")
+
+    def valid_negatives(self, entities: list[str], relation: str) -> np.ndarray:
+        """Mask of the entities that do not satisfy relation. Raises if a cell is unknown."""
+        rows = np.array([self.entity_index.get(entity, -1) for entity in entities])
+        j = self.relation_index.get(relation)
+        if j is None or (rows < 0).any() or not self.known[rows, j].all():
+            self.verify([(entity, relation) for entity in entities])
+        return ~self.satisfies[rows, j]
+
+    def draw_negatives(self, questions: list[str], relation_data: dict[str, list[dict]], seed: int) -> list[dict]:
+        """
+        One negative context per slot, drawn from the valid candidates without any API call.
+
+        Same distribution as negatives.sample_negatives (a uniform other question, then a uniform entity
+        of it, conditioned on not satisfying the relation), but all slots of a question are drawn at once
+        with numpy, so the draws differ from the rejection loop.
+        """
+        rng = np.random.default_rng(seed)
+        slots = defaultdict(list)
+        for i, question in enumerate(questions):
+            slots[question].append(i)
+
+        negatives = [None] * len(questions)
+        for question, indices in slots.items():
+            other_questions = [q for q in relation_data if q != question]
+            candidates = [context for q in other_questions for context in relation_data[q]]
+            weights = np.concatenate([np.full(len(relation_data[q]), 1 / len(relation_data[q]))
+                                      for q in other_questions])
+            weights *= self.valid_negatives([c['entity'] for c in candidates], relation_of(question))
+            if not weights.any():
+                raise ValueError(f"No valid negative for {question}")
+            for i, choice in zip(indices, rng.choice(len(candidates), size=len(indices), p=weights / weights.sum())):
+                negatives[i] = candidates[choice]
+        return negatives
+
+
+def contexts_entities(contexts_dir: str = CONTEXTS_DIR) -> list[str]:
+    entities = []
+    for file in sorted(Path(contexts_dir).glob('*.jsonl')):
+        entities.extend(context['entity'] for context in JSONLineReader().iter_read(file, fields=['entity']))
+    return list(dict.fromkeys(entities))
+
+
+def build_matrix(path: str = MATRIX_FILE) -> RelationMatrix:
+    """Load the matrix at path and verify the cells of entities / relations that are not in it yet."""
+    matrix = RelationMatrix.load(path)
+    relations = [relation_of(r['questions']) for r in JSONReader().read(RELATIONSHIPS_FILE)]
+    matrix.extend(contexts_entities(), relations)
+    filled = matrix.fill(RelationVerifier())
+    if filled or not os.path.isfile(path):
+        matrix.save(path)
+    print(f'{path}: {len(matrix.entities)} entities x {len(matrix.relations)} relations, '
+          f'{filled} cells filled, {int(matrix.satisfies.sum())} satisfied.')
+    return matrix
+
+
+if __name__ == '__main__':
+    build_matrix()
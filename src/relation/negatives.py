@@ -0,0 +1,73 @@
+"""
+Negative sampling of build_dataset.py: for every slot (a question with its positive entities), draw
+random entities of the other relations until one does not satisfy the slot's relation.
+
+The draws are identical to the serial loop (one rng.choice of another question, one of its entities,
+repeated while the entity satisfies the relation), so the dataset is reproducible from the seed. To
+verify candidates in concurrent batches, the loop is first run ahead speculatively (treating pairs
+without a verdict as accepted) to collect the pairs it will likely need. Those are verified
+together, then the loop is replayed from the saved rng state with the real verdicts, up to the first
+pair that is still unknown.
+"""
+import random
+
+from relation.verifier import RelationVerifier
+
+# Slots the speculative run looks ahead per verification batch.
+LOOKAHEAD = 256
+
+
+def relation_of(question_file: str) -> str:
+    """'questions-capableof-fly.json' -> 'capableof fly'"""
+    return question_file.split('questions-')[1].split('.json')[0].replace('-', ' ')
+
+
+def sample_negatives(questions: list[str], relation_data: dict[str, list[dict]], rng: random.Random,
+                     verifier: RelationVerifier, lookahead: int = LOOKAHEAD) -> list[dict]:
+    """
+    One negative context (of another relation) per slot.
+
+    :param questions: Question file of every slot, in slot order.
+    :param relation_data: Question file -> contexts of its entities.
+    """
+    other_questions = {question: [q for q in relation_data if q != question] for question in relation_data}
+
+    def draw(question: str) -> dict:
+        other_question = rng.choice(other_questions[question])
+        return rng.choice(relation_data[other_question])
+
+    negatives = []
+    while len(negatives) < len(questions):
+        state = rng.getstate()
+        unknown = set()
+        for question in questions[len(negatives):len(negatives) + lookahead]:
+            relation = relation_of(question)
+            while True:
+                entity = draw(question)['entity']
+                verdict = verifier.get(entity, relation)
+                if verdict is None:
+                    unknown.add((entity, relation))
+                if not verdict:
+                    break
+        verifier.verify(unknown)
+        rng.setstate(state)
+
+        while len(negatives) < len(questions):
+            question = questions[len(negatives)]
+            relation = relation_of(question)
+            slot_state = rng.getstate()
+            rejected = []
+            while True:
+                neg_entity = draw(question)
+                verdict = verifier.get(neg_entity['entity'], relation)
+                if verdict is None or not verdict:
+                    break
+                rejected.append(neg_entity['entity'])
+            if verdict is None:
+                # The speculation went another way; continue with a new batch from this slot.
+                rng.setstate(slot_state)
+                break
+            for entity in rejected:
+                print(f"{entity} satisfied {relation}. Finding new one.")
+            negatives.append(neg_entity)
+    return negatives
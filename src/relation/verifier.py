@@ -0,0 +1,86 @@
+"""
+LLM verdicts on whether an entity satisfies a relation (e.g. 'helicopter' / 'capableof fly').
+
+Verdicts are cached per (relation, entity) in VERDICT_CACHE_FILE, so a pair is only ever asked
+once across dataset builds, and new pairs are verified concurrently.
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from pydantic import BaseModel
+
+from config import PROJECT_DIR
+from utils.concurrency import get_concurrency
+from utils.openai_client import prompt_chat_structured
+
+VERDICT_CACHE_FILE = f'{PROJECT_DIR}/data/relation_verdicts.json'
+
+
+class SatisfiesRelation(BaseModel):
+    explanation: str
+    satisfies: bool
+
+
+def does_satisfy_relation(word: str, relation: str) -> bool:
+    prompt_content = (
+        f"Does the word '{word}' satisfy the relation '{relation}'? "
+        "Answer with a brief explanation and either True or False for satisfies."
+    )
+    return prompt_chat_structured(
+        messages=[{'role': 'user', 'content': prompt_content}],
+        text_format=SatisfiesRelation,
+        temperature=0
+    ).satisfies
+
+
+class RelationVerifier:
+    """Cached does_satisfy_relation, verifying batches of unknown (entity, relation) pairs concurrently."""
+
+    def __init__(self, cache_file: str = VERDICT_CACHE_FILE, concurrency: int = None,
+                 check: Callable[[str, str], bool] = does_satisfy_relation):
+        self.cache_file = cache_file
+        self.concurrency = concurrency or get_concurrency('openai')
+        self.check = check
+        self.verdicts = dict()  # relation -> entity -> bool
+        self.stats = {'cached': 0, 'verified': 0}
+        self.lock = threading.Lock()
+        if cache_file and os.path.isfile(cache_file):
+            with open(cache_file, encoding='utf-8') as f:
+                self.verdicts = json.load(f)
+
+    def get(self, entity: str, relation: str) -> bool | None:
+        """The known verdict of a pair, or None if it was not verified yet."""
+        return self.verdicts.get(relation, {}).get(entity)
+
+    def verify(self, pairs: Iterable[tuple[str, str]]):
+        """Verify all (entity, relation) pairs without a verdict concurrently and persist the new verdicts."""
+        pending = sorted({(entity, relation) for entity, relation in pairs if self.get(entity, relation) is None})
+        if not pending:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(pending))) as executor:
+            verdicts = list(executor.map(lambda pair: self.check(*pair), pending))
+        with self.lock:
+            for (entity, relation), verdict in zip(pending, verdicts):
+                self.verdicts.setdefault(relation, {})[entity] = bool(verdict)
+            self.stats['verified'] += len(pending)
+        self.save()
+
+    def satisfies(self, entity: str, relation: str) -> bool:
+        if self.get(entity, relation) is None:
+            self.verify([(entity, relation)])
+        else:
+            self.stats['cached'] += 1
+        return self.get(entity, relation)
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with self.lock:
+            if os.path.dirname(self.cache_file):
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(f'{self.cache_file}.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.verdicts, f, indent=2, ensure_ascii=False, sort_keys=True)
+            os.replace(f'{self.cache_file}.tmp', self.cache_file)
@@ -1,5 +1,96 @@
-import spacy
-from nltk import SnowballStemmer
+"""
+Shared spaCy pipeline and stemmer, loaded on first use.
 
-nlp = spacy.load("en_core_web_trf")
-stemmer = SnowballStemmer("english")
+Importing this module is cheap; the model is only loaded once get_nlp() (or the module
+attribute nlp) is accessed. Set ITDEPENDS_SPACY_MODEL (e.g. en_core_web_sm) or call
+configure() before first use to pick a lighter pipeline. A comma separated list
+(e.g. en_core_web_trf,en_core_web_sm) loads the first installed model; otherwise a missing
+model is an error, since another model changes the lemmas and with them the judge verdicts.
+"""
+import importlib.util
+import os
+import threading
+
+# Models to try in order; SPACY_MODEL is the one in use (after get_nlp()).
+SPACY_MODELS = os.environ.get('ITDEPENDS_SPACY_MODEL', 'en_core_web_trf').split(',')
+SPACY_MODEL = SPACY_MODELS[0]
+# Only tokenization, tagging and lemmatization are needed.
+DISABLED_PIPES = ['parser', 'ner']
+
+_nlp = None
+_stemmer = None
+_lock = threading.Lock()
+
+
+def configure(model_name: str = None, disable: list[str] = None):
+    """
+    Change the spaCy model (comma separated for fallbacks) and disabled pipes. Takes effect on the
+    next get_nlp(); lemmas cached for the old model are dropped.
+    """
+    global SPACY_MODELS, SPACY_MODEL, DISABLED_PIPES, _nlp
+    with _lock:
+        if model_name is not None:
+            SPACY_MODELS = model_name.split(',')
+            SPACY_MODEL = SPACY_MODELS[0]
+        if disable is not None:
+            DISABLED_PIPES = disable
+        _nlp = None
+
+    from utils.spacy_utils import normalization_cache
+    normalization_cache.clear('lemma')
+
+
+def get_nlp():
+    global SPACY_MODEL, _nlp
+    if _nlp is None:
+        with _lock:
+            if _nlp is None:
+                import spacy
+
+                for model_name in SPACY_MODELS:
+                    try:
+                        _nlp = spacy.load(model_name, disable=DISABLED_PIPES)
+                    except OSError:
+                        print(f"spaCy model '{model_name}' is not installed.")
+                        continue
+                    SPACY_MODEL = model_name
+                    break
+                else:
+                    raise OSError(f"None of the spaCy models {SPACY_MODELS} is installed. Install it with "
+                                  f"`python -m spacy download {SPACY_MODELS[0]}`, or set ITDEPENDS_SPACY_MODEL "
+                                  f"(e.g. {SPACY_MODELS[0]},en_core_web_sm to fall back to another model).")
+    return _nlp
+
+
+def resolve_model() -> str:
+    """
+    Name of the model get_nlp() uses (or will use), without loading it: the first of SPACY_MODELS that is
+    installed as a package or exists as a directory.
+    """
+    if _nlp is not None:
+        return SPACY_MODEL
+    for model_name in SPACY_MODELS:
+        try:
+            if os.path.isdir(model_name) or importlib.util.find_spec(model_name) is not None:
+                return model_name
+        except (ImportError, ValueError):
+            continue
+    return SPACY_MODELS[0]
+
+
+def get_stemmer():
+    global _stemmer
+    if _stemmer is None:
+        from nltk import SnowballStemmer
+
+        _stemmer = SnowballStemmer("english")
+    return _stemmer
+
+
+def __getattr__(name):
+    # Keeps `from spacy_model import nlp, stemmer` working, loading on import of the name.
+    if name == 'nlp':
+        return get_nlp()
+    if name == 'stemmer':
+        return get_stemmer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
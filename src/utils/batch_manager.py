@@ -0,0 +1,241 @@
+"""
+Lifecycle manager for OpenAI Batch API jobs: sharding, concurrent submission, polling,
+streaming download and resubmission of failed requests. The job state is stored as json,
+so an interrupted run can be resumed (python utils/batch_manager.py <state_file>). State files
+and shards are kept in BATCH_DIR, outside the tracked data.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from openai import OpenAI
+
+from config import PROJECT_DIR
+from data.loader import JSONLineReader, JSONLineWriter
+from utils.openai_client import get_client
+
+# Job state (<output file name>.state.json) and input shards (<output file name>-shards/).
+BATCH_DIR = f'{PROJECT_DIR}/data/batch_jobs'
+# Limits of a single batch input file.
+MAX_FILE_BYTES = 200 * 1024 * 1024
+MAX_REQUESTS_PER_FILE = 50_000
+# Seconds between status checks; grows by POLL_BACKOFF while nothing changes.
+POLL_INTERVAL = 30
+MAX_POLL_INTERVAL = 600
+POLL_BACKOFF = 1.5
+MAX_RESUBMITS = 3
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+def extract_output_text(result: dict) -> str | None:
+    """Text output of a batch result line (responses or chat completions endpoint)."""
+    body = result['response']['body']
+    if 'output' in body:
+        return body['output'][-1]['content'][-1]['text']
+    return body['choices'][0]['message']['content']
+
+
+def is_valid_result(result: dict) -> bool:
+    """Whether a batch result line succeeded and its (structured) output can be parsed."""
+    response = result.get('response') or {}
+    if result.get('error') or response.get('status_code') != 200:
+        return False
+    try:
+        text = extract_output_text(result)
+        if 'output' in response['body']:
+            json.loads(text)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return False
+    return text is not None
+
+
+def default_state_file(output_file: str) -> str:
+    return f'{BATCH_DIR}/{Path(output_file).name}.state.json'
+
+
+class BatchManager:
+    """
+    Runs all requests of a batch input file (.jsonl with custom_id, method, url, body) to completion.
+
+    The input is split into shards within MAX_FILE_BYTES / MAX_REQUESTS_PER_FILE, shards are
+    uploaded and submitted concurrently, and results are appended to output_file as soon as a
+    shard completes. Requests that failed or returned unparsable output are resubmitted (up to
+    MAX_RESUBMITS times); only valid results are written.
+    """
+
+    def __init__(self, input_file: str, output_file: str, endpoint: str = '/v1/responses', state_file: str = None,
+                 shard_dir: str = None, validate: Callable[[dict], bool] = is_valid_result,
+                 concurrency: int = 4, client: OpenAI = None):
+        self.state_file = state_file or default_state_file(output_file)
+        self.validate = validate
+        self.concurrency = concurrency
+        self.client = client or get_client('openai')
+        self.lock = threading.Lock()
+        if os.path.isfile(self.state_file):
+            with open(self.state_file, encoding='utf-8') as f:
+                self.state = json.load(f)
+        else:
+            self.state = {
+                'input_file': input_file,
+                'output_file': output_file,
+                'endpoint': endpoint,
+                'shard_dir': shard_dir or f'{BATCH_DIR}/{Path(output_file).stem}-shards',
+                'attempt': 0,
+                'shards': [],
+                'failed_ids': [],
+            }
+
+    @classmethod
+    def resume(cls, state_file: str, **kwargs) -> 'BatchManager':
+        with open(state_file, encoding='utf-8') as f:
+            state = json.load(f)
+        return cls(state['input_file'], state['output_file'], state['endpoint'], state_file=state_file, **kwargs)
+
+    def save_state(self):
+        with self.lock:
+            if os.path.dirname(self.state_file):
+                os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            with open(f'{self.state_file}.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(f'{self.state_file}.tmp', self.state_file)
+
+    def completed_ids(self) -> set[str]:
+        return {result['custom_id'] for result in JSONLineReader().iter_read(self.state['output_file'], fields=['custom_id'])}
+
+    def create_shards(self, exclude: set[str]) -> list[dict]:
+        """Split the pending requests of the input file into shards of the current attempt."""
+        attempt = self.state['attempt']
+        os.makedirs(self.state['shard_dir'], exist_ok=True)
+        shards, handle, size, count = [], None, 0, 0
+        with open(self.state['input_file'], encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or json.loads(line)['custom_id'] in exclude:
+                    continue
+                line_bytes = len(line.encode('utf-8')) + 1
+                if handle is None or size + line_bytes > MAX_FILE_BYTES or count >= MAX_REQUESTS_PER_FILE:
+                    if handle is not None:
+                        handle.close()
+                        shards[-1]['requests'] = count
+                    file = f"{self.state['shard_dir']}/attempt{attempt}-shard{len(shards)}.jsonl"
+                    shards.append({'file': file, 'attempt': attempt, 'requests': 0, 'file_id': None,
+                                   'batch_id': None, 'status': 'pending', 'downloaded': False})
+                    handle, size, count = open(file, 'w', encoding='utf-8'), 0, 0
+                handle.write(line + '\n')
+                size += line_bytes
+                count += 1
+        if handle is not None:
+            handle.close()
+            shards[-1]['requests'] = count
+        return shards
+
+    def find_batch(self, file_id: str):
+        """The batch created earlier for an uploaded input file, if any."""
+        for batch in self.client.batches.list(limit=100):
+            if batch.input_file_id == file_id:
+                return batch
+        return None
+
+    def submit(self, shard: dict):
+        # The uploaded file is recorded before the batch is created: if a run stops in between, the
+        # resumed run finds the batch by its input file instead of paying for a duplicate.
+        batch = None
+        if shard.get('file_id') is None:
+            with open(shard['file'], 'rb') as f:
+                batch_file = self.client.files.create(file=f, purpose='batch')
+            with self.lock:
+                shard['file_id'] = batch_file.id
+            self.save_state()
+        else:
+            batch = self.find_batch(shard['file_id'])
+        if batch is None:
+            batch = self.client.batches.create(input_file_id=shard['file_id'], endpoint=self.state['endpoint'],
+                                               completion_window='24h')
+        with self.lock:
+            shard['batch_id'] = batch.id
+            shard['status'] = batch.status
+        self.save_state()
+
+    def download(self, shard: dict, batch) -> tuple[int, int]:
+        """Stream the results of a finished batch to the output file. Returns (valid, invalid) counts."""
+        # Results already written by an interrupted earlier download of this shard are skipped.
+        done = self.completed_ids()
+        valid, invalid = 0, 0
+        with JSONLineWriter(self.state['output_file']) as writer:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if not file_id:
+                    continue
+                with self.client.files.with_streaming_response.content(file_id) as response:
+                    for line in response.iter_lines():
+                        if not line.strip():
+                            continue
+                        result = json.loads(line)
+                        if result['custom_id'] in done:
+                            continue
+                        if self.validate(result):
+                            writer.write(result)
+                            valid += 1
+                        else:
+                            invalid += 1
+        return valid, invalid
+
+    def poll(self, shards: list[dict]):
+        """Wait for all shards to finish, downloading each one as soon as it does."""
+        interval = POLL_INTERVAL
+        while True:
+            pending = [s for s in shards if not s['downloaded']]
+            if not pending:
+                return
+            changed = False
+            for shard in pending:
+                batch = self.client.batches.retrieve(shard['batch_id'])
+                if batch.status != shard['status']:
+                    changed = True
+                    shard['status'] = batch.status
+                if batch.status in TERMINAL_STATUSES:
+                    valid, invalid = self.download(shard, batch)
+                    shard['downloaded'] = True
+                    print(f"Batch {shard['batch_id']} {batch.status}: {valid} results, {invalid} failed.")
+                self.save_state()
+            if any(not s['downloaded'] for s in shards):
+                interval = POLL_INTERVAL if changed else min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+                time.sleep(interval)
+
+    def run(self) -> list[str]:
+        """Run (or resume) the job. Returns the custom_ids without a valid result after all resubmits."""
+        while True:
+            shards = [s for s in self.state['shards'] if s['attempt'] == self.state['attempt']]
+            if not shards:
+                input_ids = {r['custom_id'] for r in JSONLineReader().iter_read(self.state['input_file'], fields=['custom_id'])}
+                done = self.completed_ids()
+                pending = input_ids - done
+                if not pending:
+                    self.state['failed_ids'] = []
+                    self.save_state()
+                    return []
+                if self.state['attempt'] > MAX_RESUBMITS:
+                    self.state['failed_ids'] = sorted(pending)
+                    self.save_state()
+                    print(f"{len(pending)} requests failed after {MAX_RESUBMITS} resubmits.")
+                    return self.state['failed_ids']
+                shards = self.create_shards(exclude=done)
+                self.state['shards'].extend(shards)
+                self.save_state()
+
+            unsubmitted = [s for s in shards if s['batch_id'] is None]
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(self.submit, unsubmitted))
+            self.poll(shards)
+            self.state['attempt'] += 1
+            self.save_state()
+
+
+if __name__ == '__main__':
+    manager = BatchManager.resume(sys.argv[1])
+    failed = manager.run()
+    print(f"Done: {manager.state['output_file']} ({len(failed)} failed requests)")
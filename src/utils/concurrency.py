@@ -0,0 +1,74 @@
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterable
+
+# Max. number of requests in flight per provider.
+PROVIDER_CONCURRENCY = {
+    'openai': 32,
+    'openrouter': 16,
+    'fireworks': 16,
+    'runpod': 4,
+}
+DEFAULT_CONCURRENCY = 8
+
+
+def get_concurrency(provider: str) -> int:
+    return PROVIDER_CONCURRENCY.get(provider.lower(), DEFAULT_CONCURRENCY)
+
+
+class CallPool:
+    """Runs blocking calls (e.g. prompt_chat) in worker threads with a bounded number in flight."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    @classmethod
+    def for_provider(cls, provider: str) -> "CallPool":
+        return cls(get_concurrency(provider))
+
+    async def run(self, func: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+async def amap_ordered(coro_func: Callable, items: Iterable, window: int) -> AsyncIterator[tuple]:
+    """
+    Await coro_func(item) for every item and yield (item, result) in input order.
+
+    Items are consumed lazily and at most `window` coroutines are scheduled at once, so
+    memory stays bounded for large inputs.
+    """
+    in_flight = deque()
+    try:
+        for item in items:
+            in_flight.append((item, asyncio.ensure_future(coro_func(item))))
+            if len(in_flight) >= window:
+                head, task = in_flight.popleft()
+                yield head, await task
+        while in_flight:
+            head, task = in_flight.popleft()
+            yield head, await task
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+
+
+def map_ordered(func: Callable, items: Iterable, pool: CallPool, window: int = None) -> AsyncIterator[tuple]:
+    """
+    Apply func to every item through the pool and yield (item, result) in input order.
+
+    At most `window` calls (default: twice the pool size) are scheduled at once.
+    """
+    return amap_ordered(lambda item: pool.run(func, item), items, window or pool.concurrency * 2)
@@ -0,0 +1,174 @@
+"""
+Single-pass multilingual entity matching for rule-based judging.
+
+All entity surface forms of data/contexts (including their lang_versions) are compiled into one
+Aho–Corasick automaton per language, so an answer is scanned once for all entities. Each entity
+of a response is then FOUND (whole-word match), ABSENT (no match at a word start) or UNDECIDED
+(match at a word start that continues into a longer word, e.g. an inflected form). Callers decide
+UNDECIDED entities otherwise, e.g. with the spaCy lemmatizer for English.
+"""
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from config import PROJECT_DIR
+from data.loader import JSONLineReader
+
+CONTEXTS_DIR = f'{PROJECT_DIR}/data/contexts'
+
+FOUND = 'found'
+UNDECIDED = 'undecided'
+ABSENT = 'absent'
+_RANK = {ABSENT: 0, UNDECIDED: 1, FOUND: 2}
+
+# Languages written without spaces between words; any occurrence counts.
+NO_WORD_BOUNDARY_LANGS = {'zh'}
+# Arabic clitics that may be attached in front of an entity (article, conjunctions, prepositions).
+ARABIC_PREFIXES = {'ال', 'و', 'وال', 'ب', 'بال', 'ل', 'لل', 'ف', 'فال', 'ك', 'كال'}
+# Alternative surface forms (normalized) -> canonical entity, as in Judge.process_mentioned_entities.
+ALIASES = {'ar': {'هليكوبتر': 'طائرة هليكوبتر'}}
+# English plurals that do not start with the singular (regular plurals are UNDECIDED prefix matches).
+IRREGULAR_PLURALS = {'goose': 'geese', 'mouse': 'mice', 'louse': 'lice', 'ox': 'oxen', 'man': 'men',
+                     'woman': 'women', 'child': 'children', 'foot': 'feet', 'tooth': 'teeth'}
+
+
+def normalize_entity(entity: str, lang: str) -> str:
+    entity = entity.lower().strip()
+    if lang == 'ar':
+        # Remove Arabic definite article "ال" (al-)
+        entity = entity.removeprefix('ال')
+    return entity
+
+
+def surface_forms(entity: str, lang: str) -> list[str]:
+    """Normalized forms an entity is matched by: the entity itself and, for English, plurals it is no prefix of."""
+    entity = normalize_entity(entity, lang)
+    forms = [entity]
+    if lang == 'en':
+        head, _, last = entity.rpartition(' ')
+        head = f'{head} ' if head else ''
+        if last in IRREGULAR_PLURALS:
+            forms.append(head + IRREGULAR_PLURALS[last])
+        elif len(last) > 1 and last.endswith('y') and last[-2] not in 'aeiou':
+            forms.append(head + last[:-1] + 'ies')
+        elif last.endswith('fe'):
+            forms.append(head + last[:-2] + 'ves')
+        elif last.endswith('f'):
+            forms.append(head + last[:-1] + 'ves')
+    return forms
+
+
+class AhoCorasick:
+    """Minimal Aho–Corasick automaton reporting all (start, end, pattern) occurrences in a text."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto = [dict()]
+        self.fail = [0]
+        self.outputs = [[]]
+        for pattern in set(patterns):
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append(dict())
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.outputs[state].append(pattern)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[tuple[int, int, str]]:
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern in self.outputs[state]:
+                yield end - len(pattern), end, pattern
+
+
+class EntityMatcher:
+    def __init__(self, entities: dict[str, Iterable[str]]):
+        """:param entities: lang -> entity surface forms."""
+        self.forms = defaultdict(dict)  # lang -> normalized form -> canonical entity
+        for lang, lang_entities in entities.items():
+            for entity in lang_entities:
+                for form in surface_forms(entity, lang):
+                    self.forms[lang][form] = entity.lower().strip()
+            for alias, canonical in ALIASES.get(lang, {}).items():
+                self.forms[lang][alias] = canonical
+        self.automata = {lang: AhoCorasick(forms) for lang, forms in self.forms.items()}
+
+    @classmethod
+    def from_contexts(cls, contexts_dir: str = CONTEXTS_DIR) -> 'EntityMatcher':
+        """Build the matcher from all entities (and their lang_versions) in data/contexts."""
+        entities = defaultdict(set)
+        reader = JSONLineReader()
+        for file in sorted(Path(contexts_dir).glob('*.jsonl')):
+            for context in reader.iter_read(file):
+                if 'lang_versions' not in context:
+                    entities['en'].add(context['entity'])
+                for lang, version in context.get('lang_versions', {}).items():
+                    entities[lang].add(version['entity'])
+        return cls(entities)
+
+    @staticmethod
+    def classify(text: str, start: int, end: int, lang: str) -> str:
+        if lang in NO_WORD_BOUNDARY_LANGS:
+            return FOUND
+        word_start = start
+        while word_start > 0 and text[word_start - 1].isalnum():
+            word_start -= 1
+        prefix = text[word_start:start]
+        if prefix and not (lang == 'ar' and prefix in ARABIC_PREFIXES):
+            return ABSENT  # inside another word
+        if end < len(text) and text[end].isalnum():
+            return UNDECIDED
+        return FOUND
+
+    def match(self, answer: str, entities: list[str], lang: str = 'en') -> dict[str, str]:
+        """Status (FOUND, UNDECIDED or ABSENT) of each (lowercased) entity in the answer."""
+        text = answer.lower()
+        status = {entity.lower(): ABSENT for entity in entities}
+        wanted = {form: entity.lower() for entity in entities for form in surface_forms(entity, lang)}
+        for alias, canonical in ALIASES.get(lang, {}).items():
+            if canonical in status:
+                wanted.setdefault(alias, canonical)
+
+        def update(start: int, end: int, form: str):
+            entity = wanted[form]
+            new = self.classify(text, start, end, lang)
+            if _RANK[new] > _RANK[status[entity]]:
+                status[entity] = new
+
+        automaton = self.automata.get(lang)
+        known = self.forms.get(lang, {})
+        if automaton is not None:
+            for start, end, form in automaton.iter_matches(text):
+                if form in wanted:
+                    update(start, end, form)
+        # Entities that are not in data/contexts are searched for directly.
+        for form in wanted:
+            if form in known or not form:
+                continue
+            start = text.find(form)
+            while start != -1:
+                update(start, start + len(form), form)
+                start = text.find(form, start + 1)
+        return status
@@ -0,0 +1,351 @@
+"""
+Local stand-in for the OpenAI-compatible and DeepL APIs, for offline runs, load tests and benchmarks.
+
+Serves chat completions, responses (incl. responses.parse structured outputs), files, batches and
+DeepL /v2/translate with configurable latency, injected 429s (with Retry-After) and deterministic
+canned or replayed responses. Point the pipeline at it with MockServer.use() or by setting
+ITDEPENDS_API_BASE_URL / ITDEPENDS_DEEPL_URL (see utils/openai_client.py and utils/translate.py).
+"""
+import hashlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+from data.loader import JSONLineReader, JSONLineWriter
+
+BASE_URL_ENV = 'ITDEPENDS_API_BASE_URL'
+DEEPL_URL_ENV = 'ITDEPENDS_DEEPL_URL'
+
+
+def request_key(endpoint: str, body: dict) -> str:
+    """Replay key of a chat/responses request: hash of endpoint, model and messages."""
+    messages = body.get('messages', body.get('input'))
+    payload = json.dumps({'endpoint': endpoint, 'model': body.get('model'), 'messages': messages},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def fake_instance(schema: dict, seed: str, defs: dict = None):
+    """Deterministic instance of a json schema (enum values and booleans are picked by hash of seed)."""
+    defs = defs or schema.get('$defs', {})
+    if '$ref' in schema:
+        return fake_instance(defs[schema['$ref'].rsplit('/', 1)[-1]], seed, defs)
+    digest = int(hashlib.md5(seed.encode('utf-8')).hexdigest(), 16)
+    if 'enum' in schema:
+        return schema['enum'][digest % len(schema['enum'])]
+    if 'anyOf' in schema:
+        return fake_instance(schema['anyOf'][0], seed, defs)
+    kind = schema.get('type')
+    if kind == 'object':
+        return {name: fake_instance(prop, f'{seed}/{name}', defs) for name, prop in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return []
+    if kind == 'boolean':
+        return bool(digest % 2)
+    if kind in ('integer', 'number'):
+        return digest % 10
+    return 'mock'
+
+
+def default_responder(endpoint: str, body: dict) -> str:
+    """Canned answer: a schema-conforming json object for structured requests, a fixed text otherwise."""
+    key = request_key(endpoint, body)
+    fmt = (body.get('text') or {}).get('format') or (body.get('response_format') or {}).get('json_schema')
+    if fmt and fmt.get('schema'):
+        return json.dumps(fake_instance(fmt['schema'], key))
+    return f'Mock response {key[:8]}.'
+
+
+class MockServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, latency_jitter: float = 0.0,
+                 rate_limit_prob: float = 0.0, retry_after: float = 1.0, responder: Callable[[str, dict], str] = None,
+                 replay_file: str = None, record_file: str = None, batch_latency: float = 0.0, seed: int = 0):
+        """
+        :param latency: Seconds added to every chat/responses/translate request (plus uniform jitter).
+        :param rate_limit_prob: Probability of answering a request with 429 and a Retry-After header.
+        :param responder: (endpoint, request body) -> answer text; default_responder if not given.
+        :param replay_file: .jsonl of recorded {'key', 'response'} lines that are served for matching requests.
+        :param record_file: Every served answer is appended there, in the replay_file format.
+        :param batch_latency: Seconds until a submitted batch is completed.
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self.responder = responder or default_responder
+        self.batch_latency = batch_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.files = dict()
+        self.batches = dict()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'replayed': 0}
+
+        self.replay = dict()
+        if replay_file:
+            self.replay = {r['key']: r['response'] for r in JSONLineReader().iter_read(replay_file)}
+        self.recorder = JSONLineWriter(record_file, buffer_size=1).open() if record_file else None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes; without TCP_NODELAY each response waits for a delayed ACK.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server.handle(self, 'GET')
+
+            def do_POST(self):
+                server.handle(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    @property
+    def deepl_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @contextmanager
+    def use(self):
+        """Route all providers and DeepL to this server while the context is active."""
+        from utils.openai_client import close_clients
+
+        previous = {env: os.environ.get(env) for env in (BASE_URL_ENV, DEEPL_URL_ENV)}
+        os.environ[BASE_URL_ENV] = self.base_url
+        os.environ[DEEPL_URL_ENV] = self.deepl_url
+        try:
+            yield self
+        finally:
+            for env, value in previous.items():
+                if value is None:
+                    os.environ.pop(env, None)
+                else:
+                    os.environ[env] = value
+            close_clients()
+
+    def new_id(self, prefix: str) -> str:
+        return f'{prefix}-mock{next(self.ids)}'
+
+    # --- request handling
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        path = urlparse(request.path).path
+        length = int(request.headers.get('Content-Length') or 0)
+        raw = request.rfile.read(length) if length else b''
+        with self.lock:
+            self.stats['requests'] += 1
+            rate_limited = path.endswith(('/chat/completions', '/responses', '/translate')) \
+                and self.random.random() < self.rate_limit_prob
+            if rate_limited:
+                self.stats['rate_limited'] += 1
+        if rate_limited:
+            return self.send(request, 429, {'error': {'message': 'Rate limit reached (mock).', 'type': 'requests',
+                                                      'code': 'rate_limit_exceeded'}},
+                             headers={'Retry-After': str(self.retry_after)})
+
+        try:
+            if method == 'POST' and path.endswith('/chat/completions'):
+                self.delay()
+                return self.send(request, 200, self.chat_completion(json.loads(raw)))
+            if method == 'POST' and path.endswith('/responses'):
+                self.delay()
+                return self.send(request, 200, self.response(json.loads(raw)))
+            if method == 'POST' and path.endswith('/v2/translate'):
+                self.delay()
+                return self.send(request, 200, self.translate(raw, request.headers.get('Content-Type', '')))
+            if method == 'POST' and path.endswith('/files'):
+                return self.send(request, 200, self.upload(raw, request.headers.get('Content-Type', '')))
+            if method == 'GET' and path.endswith('/content') and '/files/' in path:
+                content = self.files[path.split('/files/')[1].split('/')[0]]['content']
+                return self.send(request, 200, content, content_type='application/octet-stream')
+            if method == 'POST' and path.endswith('/batches'):
+                return self.send(request, 200, self.create_batch(json.loads(raw)))
+            if method == 'GET' and path.endswith('/batches'):
+                return self.send(request, 200, self.list_batches())
+            if method == 'GET' and '/batches/' in path:
+                return self.send(request, 200, self.retrieve_batch(path.rsplit('/', 1)[-1]))
+        except KeyError as e:
+            return self.send(request, 404, {'error': {'message': f'Not found: {e}', 'type': 'invalid_request_error'}})
+        return self.send(request, 404, {'error': {'message': f'Unknown endpoint {method} {path}', 'type': 'invalid_request_error'}})
+
+    def delay(self):
+        if self.latency or self.latency_jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.latency_jitter))
+
+    @staticmethod
+    def send(request: BaseHTTPRequestHandler, status: int, body, headers: dict = None,
+             content_type: str = 'application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def answer(self, endpoint: str, body: dict) -> str:
+        key = request_key(endpoint, body)
+        if key in self.replay:
+            with self.lock:
+                self.stats['replayed'] += 1
+            return self.replay[key]
+        text = self.responder(endpoint, body)
+        if self.recorder is not None:
+            with self.lock:
+                self.recorder.write({'key': key, 'endpoint': endpoint, 'model': body.get('model'), 'response': text})
+        return text
+
+    @staticmethod
+    def usage(body: dict, text: str) -> tuple[int, int]:
+        prompt = json.dumps(body.get('messages', body.get('input', '')), ensure_ascii=False)
+        return len(prompt) // 4 + 1, len(text) // 4 + 1
+
+    def chat_completion(self, body: dict) -> dict:
+        text = self.answer('chat/completions', body)
+        prompt_tokens, completion_tokens = self.usage(body, text)
+        return {
+            'id': self.new_id('chatcmpl'), 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop',
+                         'logprobs': None}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+    def response(self, body: dict) -> dict:
+        text = self.answer('responses', body)
+        input_tokens, output_tokens = self.usage(body, text)
+        return {
+            'id': self.new_id('resp'), 'object': 'response', 'created_at': int(time.time()), 'status': 'completed',
+            'model': body.get('model', 'mock'), 'parallel_tool_calls': True, 'tool_choice': 'auto', 'tools': [],
+            'temperature': body.get('temperature'), 'text': body.get('text'),
+            'output': [{
+                'type': 'message', 'id': self.new_id('msg'), 'status': 'completed', 'role': 'assistant',
+                'content': [{'type': 'output_text', 'text': text, 'annotations': []}],
+            }],
+            'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                      'total_tokens': input_tokens + output_tokens,
+                      'input_tokens_details': {'cached_tokens': 0}, 'output_tokens_details': {'reasoning_tokens': 0}},
+        }
+
+    def translate(self, raw: bytes, content_type: str) -> dict:
+        if content_type.startswith('application/json'):
+            form = json.loads(raw)
+            texts = form['text'] if isinstance(form['text'], list) else [form['text']]
+            target = form.get('target_lang', 'DE')
+        else:
+            form = parse_qs(raw.decode('utf-8'))
+            texts, target = form['text'], form.get('target_lang', ['DE'])[0]
+        return {'translations': [{'detected_source_language': 'EN',
+                                   'text': self.answer('translate', {'model': target, 'messages': text})}
+                                  for text in texts]}
+
+    def upload(self, raw: bytes, content_type: str) -> dict:
+        message = BytesParser(policy=default_policy).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + raw)
+        fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+        part = fields['file']
+        file_id = self.new_id('file')
+        content = part.get_payload(decode=True)
+        with self.lock:
+            self.files[file_id] = {'content': content, 'filename': part.get_filename() or 'upload.jsonl',
+                                   'purpose': fields['purpose'].get_content().strip() if 'purpose' in fields else 'batch'}
+        return self.file_object(file_id)
+
+    def file_object(self, file_id: str) -> dict:
+        file = self.files[file_id]
+        return {'id': file_id, 'object': 'file', 'bytes': len(file['content']), 'created_at': int(time.time()),
+                'filename': file['filename'], 'purpose': file['purpose'], 'status': 'processed'}
+
+    def create_batch(self, body: dict) -> dict:
+        batch_id = self.new_id('batch')
+        with self.lock:
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': body['endpoint'], 'input_file_id': body['input_file_id'],
+                'completion_window': body.get('completion_window', '24h'), 'status': 'validating',
+                'created_at': int(time.time()), 'output_file_id': None, 'error_file_id': None,
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0}, 'submitted': time.time(),
+            }
+        return self.batch_object(batch_id)
+
+    def retrieve_batch(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        if batch['status'] != 'completed' and time.time() - batch['submitted'] >= self.batch_latency:
+            self.complete_batch(batch)
+        elif batch['status'] == 'validating':
+            batch['status'] = 'in_progress'
+        return self.batch_object(batch_id)
+
+    def list_batches(self) -> dict:
+        batches = [self.batch_object(batch_id) for batch_id in reversed(list(self.batches))]  # newest first
+        return {'object': 'list', 'data': batches, 'first_id': batches[0]['id'] if batches else None,
+                'last_id': batches[-1]['id'] if batches else None, 'has_more': False}
+
+    def batch_object(self, batch_id: str) -> dict:
+        return {key: value for key, value in self.batches[batch_id].items() if key != 'submitted'}
+
+    def complete_batch(self, batch: dict):
+        endpoint = batch['endpoint'].rsplit('/v1/', 1)[-1]
+        lines = []
+        for line in self.files[batch['input_file_id']]['content'].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            body = self.response(task['body']) if endpoint == 'responses' else self.chat_completion(task['body'])
+            lines.append(json.dumps({'id': self.new_id('batch_req'), 'custom_id': task['custom_id'],
+                                     'response': {'status_code': 200, 'request_id': self.new_id('req'), 'body': body},
+                                     'error': None}, ensure_ascii=False))
+        output_file_id = self.new_id('file')
+        with self.lock:
+            self.files[output_file_id] = {'content': ('\n'.join(lines) + '\n').encode('utf-8'),
+                                          'filename': 'batch_output.jsonl', 'purpose': 'batch_output'}
+            batch.update({'status': 'completed', 'output_file_id': output_file_id, 'completed_at': int(time.time()),
+                          'request_counts': {'total': len(lines), 'completed': len(lines), 'failed': 0}})
+
+
+if __name__ == '__main__':
+    HOST, PORT = '127.0.0.1', 8089
+    LATENCY = 0.2
+    RATE_LIMIT_PROB = 0.0
+
+    server = MockServer(HOST, PORT, latency=LATENCY, rate_limit_prob=RATE_LIMIT_PROB)
+    print(f'Mock API on {server.base_url}; export {BASE_URL_ENV}={server.base_url} {DEEPL_URL_ENV}={server.deepl_url}')
+    server.httpd.serve_forever()
@@ -1,63 +1,217 @@
-from openai import OpenAI
+import os
+import threading
+from collections import defaultdict
+
+import httpx
+from openai import OpenAI, DefaultHttpxClient
 from openai.types import Batch
 
-from config import Credentials
+from config import Credentials, PROJECT_DIR
+from utils.rate_limit import estimate_tokens, get_limiter
+from utils.response_cache import ResponseCache
+
+PROVIDERS = {
+    'openai': {'base_url': 'https://api.openai.com/v1', 'api_key': 'openai_api_key'},
+    'openrouter': {'base_url': 'https://openrouter.ai/api/v1', 'api_key': 'openrouter_api_key'},
+    'fireworks': {'base_url': 'https://api.fireworks.ai/inference/v1', 'api_key': 'fw_api_key'},
+    'runpod': {'base_url': 'https://api.runpod.ai/v2/j8erq8xjlg68rh/openai/v1', 'api_key': 'runpod_api_key'},
+}
+
+# If set (e.g. to a utils/mock_server.py instance), all providers are served from this base url.
+BASE_URL_ENV = 'ITDEPENDS_API_BASE_URL'
+
+# Max. number of (keep-alive) connections per provider client.
+CONNECTION_POOL_SIZE = 64
+KEEPALIVE_EXPIRY = 60.0
+
+_clients = {}
+_clients_lock = threading.Lock()
+_connection_stats = defaultdict(lambda: {'opened': 0, 'reused': 0})
+_stats_lock = threading.Lock()
+_cache = None
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    """HTTP transport that records whether a request opened a new connection or reused one."""
+
+    def __init__(self, provider: str, **kwargs):
+        super().__init__(**kwargs)
+        self.provider = provider
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        opened = False
+
+        def trace(event_name, info):
+            nonlocal opened
+            if event_name == 'connection.connect_tcp.complete':
+                opened = True
+
+        request.extensions['trace'] = trace
+        response = super().handle_request(request)
+        with _stats_lock:
+            _connection_stats[self.provider]['opened' if opened else 'reused'] += 1
+        return response
+
+
+def get_provider_config(provider: str) -> tuple[str, str]:
+    """Return (base_url, api_key) for a provider."""
+    config = PROVIDERS.get(provider.lower())
+    if config is None:
+        raise ValueError(f"Unknown provider: {provider}")
+    return os.environ.get(BASE_URL_ENV) or config['base_url'], getattr(Credentials, config['api_key'])
+
+
+def get_client(provider: str = "openai", max_retries: int = None) -> OpenAI:
+    """
+    Return the shared client for a provider, creating it on first use.
+
+    Clients keep their connections alive, so repeated calls skip the TCP/TLS setup.
+    The OpenAI client is thread-safe and may be shared across worker threads.
+    With max_retries, a variant sharing the same connections but with its own retry count is returned.
+    """
+    provider = provider.lower()
+    base_url, api_key = get_provider_config(provider)
+    key = (provider, base_url, api_key)
+    if max_retries is not None:
+        variant_key = key + (max_retries,)
+        client = _clients.get(variant_key)
+        if client is None:
+            client = get_client(provider).with_options(max_retries=max_retries)
+            with _clients_lock:
+                client = _clients.setdefault(variant_key, client)
+        return client
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                limits = httpx.Limits(max_connections=CONNECTION_POOL_SIZE,
+                                      max_keepalive_connections=CONNECTION_POOL_SIZE,
+                                      keepalive_expiry=KEEPALIVE_EXPIRY)
+                transport = _CountingTransport(provider, limits=limits)
+                client = OpenAI(api_key=api_key, base_url=base_url,
+                                http_client=DefaultHttpxClient(transport=transport))
+                _clients[key] = client
+    return client
+
+
+def close_clients():
+    """Close all pooled clients (e.g. after changing CONNECTION_POOL_SIZE)."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def get_connection_stats() -> dict:
+    """Per provider count of requests that opened a new connection vs. reused a pooled one."""
+    with _stats_lock:
+        return {provider: dict(stats) for provider, stats in _connection_stats.items()}
+
+
+def enable_cache(path: str = f'{PROJECT_DIR}/data/llm_cache.sqlite', max_size_mb: float = 512,
+                 read_only: bool = False) -> ResponseCache:
+    """Serve repeated prompt_chat / prompt_chat_structured requests from an on-disk cache."""
+    global _cache
+    disable_cache()
+    _cache = ResponseCache(path, max_size_mb=max_size_mb, read_only=read_only)
+    return _cache
+
+
+def disable_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+def get_cache_stats() -> dict:
+    return _cache.stats() if _cache is not None else {}
+
+
+def _use_cache(cache: bool | None, temperature: float) -> bool:
+    """By default only deterministic (temperature 0) requests are cached, sampled ones must stay sampled."""
+    return _cache is not None and (temperature == 0 if cache is None else cache)
+
+
+def forget_cached_response(messages: list[dict], text_format=None, model: str = "gpt-4.1-nano-2025-04-14",
+                           temperature: float = 0.7, provider: str = "openai"):
+    """Drop the cached response of a request (e.g. one the caller rejected), so the next call asks the model again."""
+    if _cache is not None:
+        schema = text_format.model_json_schema() if text_format is not None else None
+        _cache.delete(ResponseCache.make_key(provider.lower(), model, messages, temperature, schema))
+
 
 def prompt_chat(
     messages: list[dict],
     model: str = "gpt-4.1-nano-2025-04-14",
     temperature: float = 0.7,
-    provider: str = "openai",  # 'openai', 'openrouter', 'fireworks'
+    provider: str = "openai",  # 'openai', 'openrouter', 'fireworks', 'runpod'
+    cache: bool = None,  # None: use the response cache (if enabled) only at temperature 0
 ) -> str:
     """
     Flexible wrapper to send a chat completion prompt to OpenAI, OpenRouter, or Fireworks.
     Automatically selects base_url and API key based on provider.
     """
     provider = provider.lower()
-    if provider == "openrouter":
-        base_url = "https://openrouter.ai/api/v1"
-        api_key = Credentials.openrouter_api_key
-    elif provider == "fireworks":
-        base_url = "https://api.fireworks.ai/inference/v1"
-        api_key = Credentials.fw_api_key
-    elif provider == "openai":
-        base_url = "https://api.openai.com/v1"
-        api_key = Credentials.openai_api_key
-    elif provider == "runpod":
-        base_url ='https://api.runpod.ai/v2/j8erq8xjlg68rh/openai/v1'
-        api_key = Credentials.runpod_api_key
-    else:
-        raise ValueError(f"Unknown provider: {provider}")
+    cache_key = None
+    if _use_cache(cache, temperature):
+        cache_key = ResponseCache.make_key(provider, model, messages, temperature)
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-    client = OpenAI(api_key=api_key, base_url=base_url)
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        extra_body={'reasoning': {'exclude': True}, 'provider': {'sort': 'throughput'}} if provider == 'openrouter' else {},
+    # Retries (with backoff and Retry-After) are done by the provider's rate limiter.
+    client = get_client(provider, max_retries=0)
+    response = get_limiter(provider).call(
+        lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            extra_body={'reasoning': {'exclude': True}, 'provider': {'sort': 'throughput'}} if provider == 'openrouter' else {},
+        ),
+        tokens=estimate_tokens(messages),
+        usage=lambda r: r.usage.total_tokens if r.usage else None,
     )
-    return response.choices[0].message.content.strip()
+    content = response.choices[0].message.content.strip()
+    if cache_key is not None:
+        _cache.put(cache_key, content)
+    return content
 
 def prompt_chat_structured(
     messages: list[dict],
     text_format,
     model: str = "gpt-4.1-nano-2025-04-14",
     temperature: float = 0.7,
+    cache: bool = None,  # None: use the response cache (if enabled) only at temperature 0
 ):
     """
     Simple wrapper to send a chat completion prompt and return the response text.
     """
-    client = OpenAI(api_key=Credentials.openai_api_key)
-    response = client.responses.parse(
-        model=model,
-        input=messages,
-        temperature=temperature,
-        text_format=text_format,
+    cache_key = None
+    if _use_cache(cache, temperature):
+        cache_key = ResponseCache.make_key("openai", model, messages, temperature, text_format.model_json_schema())
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            return text_format.model_validate_json(cached)
+
+    client = get_client("openai", max_retries=0)
+    response = get_limiter("openai").call(
+        lambda: client.responses.parse(
+            model=model,
+            input=messages,
+            temperature=temperature,
+            text_format=text_format,
+        ),
+        tokens=estimate_tokens(messages),
+        usage=lambda r: r.usage.total_tokens if r.usage else None,
     )
+    if cache_key is not None and response.output_parsed is not None:
+        _cache.put(cache_key, response.output_parsed.model_dump_json())
     return response.output_parsed
 
 def upload_batch_file(file_name: str):
-    client = OpenAI(api_key=Credentials.openai_api_key)
+    client = get_client("openai")
     with open(file_name, "rb") as file:
         batch_file = client.files.create(
             file=file,
@@ -74,7 +228,7 @@ def create_batch_job(file_name: str, endpoint="/v1/chat/completions") -> Batch:
                          "/v1/chat/completions".
     :return: Metadata of the created batch job, including job ID.
     """
-    client = OpenAI(api_key=Credentials.openai_api_key)
+    client = get_client("openai")
     batch_file = upload_batch_file(file_name)
     batch_job = client.batches.create(
         input_file_id=batch_file.id,
@@ -0,0 +1,265 @@
+"""
+Per-provider rate limiting shared by prompt_chat, prompt_chat_structured and translate.
+
+Every provider has a token bucket for requests per minute and (optionally) one for tokens per
+minute, plus an AIMD concurrency limit: each success raises the number of requests in flight by
+1/limit (about +1 per round of requests), each 429 halves it (at most once per cooldown) and
+pauses all callers of the provider for the Retry-After duration. Rate limited requests are retried
+after Retry-After, transient errors (connection errors, 5xx) with exponential backoff and jitter.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+import openai
+import requests
+
+from utils.concurrency import get_concurrency
+
+# Requests and tokens per minute (None: unlimited). Adjust to the quota of your account tier.
+PROVIDER_LIMITS = {
+    'openai': {'rpm': 5_000, 'tpm': 2_000_000},
+    'openrouter': {'rpm': 1_000, 'tpm': None},
+    'fireworks': {'rpm': 600, 'tpm': None},
+    'runpod': {'rpm': 300, 'tpm': None},
+    'deepl': {'rpm': 300, 'tpm': None},  # DeepL bills characters per month, not tokens per minute
+}
+DEFAULT_LIMITS = {'rpm': 600, 'tpm': None}
+# Seconds of quota that may be used at once.
+BURST_SECONDS = 10
+MAX_RETRIES = 8
+BACKOFF_BASE = 1.0
+MAX_BACKOFF = 60.0
+DECREASE_FACTOR = 0.5
+MIN_CONCURRENCY = 1
+# Minimum seconds between two concurrency decreases, so one burst of 429s only counts once.
+DECREASE_COOLDOWN = 2.0
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def estimate_tokens(messages) -> int:
+    """Rough token count of a prompt (~4 characters per token)."""
+    text = messages if isinstance(messages, str) else json.dumps(messages, ensure_ascii=False)
+    return len(text) // 4 + 1
+
+
+def get_status_code(error: Exception) -> int | None:
+    status = getattr(error, 'status_code', None)
+    if status is None and getattr(error, 'response', None) is not None:
+        status = getattr(error.response, 'status_code', None)
+    return status
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return get_status_code(error) == 429
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout)):
+        return True
+    status = get_status_code(error)
+    return status is not None and status >= 500
+
+
+def get_retry_after(error: Exception) -> float | None:
+    """Seconds to wait according to the Retry-After (or retry-after-ms) header of a failed request."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute` / 60 per second."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Take amount from the bucket, blocking until it is available. Returns the seconds waited."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                wait = (amount - self.level) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def adjust(self, amount: float):
+        """Correct an earlier estimate: positive amounts are taken (the level may go negative), negative returned."""
+        with self.lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the number of requests in flight, with a shared pause after 429s."""
+
+    def __init__(self, max_limit: int, min_limit: int = MIN_CONCURRENCY):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """Block until a request may start. Returns the seconds waited."""
+        start = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+        return time.monotonic() - start
+
+    def release(self, success: bool = True):
+        with self.condition:
+            self.in_flight -= 1
+            if success:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def on_rate_limit(self, retry_after: float = None):
+        with self.condition:
+            now = time.monotonic()
+            if now - self.last_decrease >= DECREASE_COOLDOWN:
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self.last_decrease = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self.condition.notify_all()
+
+
+class RateLimiter:
+    """Rate limit layer of one provider; see the module docstring."""
+
+    def __init__(self, provider: str, rpm: float = None, tpm: float = None, concurrency: int = None):
+        self.provider = provider
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(concurrency or get_concurrency(provider))
+        self.stats = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1):
+        with self.lock:
+            self.stats[name] += value
+
+    def call(self, func: Callable, tokens: int = 0, usage: Callable = None):
+        """
+        Run func() within the provider's limits, retrying rate limited and transient errors.
+
+        :param tokens: Estimated tokens of the request, taken from the tokens per minute bucket.
+        :param usage: result -> actual tokens used (or None); corrects the estimate afterwards.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            waited = self.concurrency.acquire()
+            if self.requests is not None:
+                waited += self.requests.acquire(1)
+            if self.tokens is not None and tokens:
+                waited += self.tokens.acquire(tokens)
+            self.count('waited_s', waited)
+            self.count('requests')
+            try:
+                result = func()
+            except Exception as e:
+                self.concurrency.release(success=False)
+                if is_rate_limited(e):
+                    retry_after = get_retry_after(e)
+                    self.concurrency.on_rate_limit(retry_after)
+                    self.count('rate_limited')
+                elif is_transient(e):
+                    retry_after = None
+                    self.count('errors')
+                else:
+                    raise
+                if attempt == MAX_RETRIES:
+                    raise
+                self.count('retries')
+                if retry_after is None:
+                    delay = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                else:
+                    delay = retry_after * random.uniform(1.0, 1.2)  # the jitter avoids a synchronized retry burst
+                time.sleep(delay)
+                continue
+
+            self.concurrency.release(success=True)
+            if self.tokens is not None and usage is not None:
+                actual = usage(result)
+                if actual:
+                    self.tokens.adjust(actual - min(tokens, self.tokens.capacity))
+            return result
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats['concurrency'] = round(self.concurrency.limit, 2)
+        return stats
+
+
+def get_limiter(provider: str) -> RateLimiter:
+    """The shared RateLimiter of a provider ('openai', 'openrouter', 'fireworks', 'runpod', 'deepl')."""
+    provider = provider.lower()
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                limits = PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS)
+                limiter = RateLimiter(provider, rpm=limits['rpm'], tpm=limits['tpm'])
+                _limiters[provider] = limiter
+    return limiter
+
+
+def reset_limiters():
+    """Drop all limiters (e.g. after changing PROVIDER_LIMITS or PROVIDER_CONCURRENCY)."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def get_rate_limit_stats() -> dict:
+    """Per provider requests, retries, 429s, seconds waited and current concurrency limit."""
+    with _limiters_lock:
+        return {provider: limiter.get_stats() for provider, limiter in _limiters.items()}
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache for LLM responses backed by SQLite.
+
+    Entries are keyed by a hash of the request (provider, model, messages, temperature, schema).
+    Once the stored values exceed max_size_mb, the least recently used entries are evicted.
+    In read_only mode the cache is only consulted, never written or touched; a missing file is an empty cache.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 512, read_only: bool = False):
+        self.path = str(path)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        if read_only and not os.path.isfile(self.path):
+            print(f"Response cache {self.path} does not exist, all requests are misses.")
+            self.conn = None
+        elif read_only:
+            self.conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed)')
+            self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0] if self.conn else 0
+
+    @staticmethod
+    def make_key(provider: str, model: str, messages: list[dict], temperature: float, schema: dict = None) -> str:
+        payload = json.dumps(
+            {'provider': provider, 'model': model, 'messages': messages, 'temperature': temperature, 'schema': schema},
+            sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone() if self.conn else None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self.conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+                self.conn.commit()
+            return row[0]
+
+    def put(self, key: str, value: str):
+        if self.read_only:
+            return
+        size = len(value.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                              (key, value, size, time.time()))
+            self.size += size - (old[0] if old else 0)
+            self._evict()
+            self.conn.commit()
+
+    def delete(self, key: str):
+        if self.read_only:
+            return
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if old is not None:
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.conn.commit()
+                self.size -= old[0]
+
+    def _evict(self):
+        while self.size > self.max_size:
+            rows = self.conn.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 100').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.size <= self.max_size:
+                    break
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.size -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0] if self.conn else 0
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': entries, 'size_bytes': self.size}
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
@@ -1,18 +1,130 @@
-from spacy_model import nlp, stemmer
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator
 
+import spacy_model
+from config import PROJECT_DIR
+from spacy_model import get_nlp, get_stemmer
 
-def force_noun_lemmatization(word: str) -> str:
-    doc = nlp.make_doc(word.lower())
+NORMALIZATION_CACHE_FILE = f'{PROJECT_DIR}/data/normalization_cache.json'
+NORMALIZATION_CACHE_SIZE = 100_000
+
+
+class NormalizationCache:
+    """
+    Bounded LRU cache for word normalizations (noun lemma, stem), keyed by (kind, lowercased word).
+
+    Can be persisted as json between runs. Lemmas written with another spaCy model are ignored, since
+    they depend on the model; stems do not.
+    """
+
+    def __init__(self, max_size: int = NORMALIZATION_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, kind: str, word: str, compute: Callable[[str], str]) -> str:
+        key = (kind, word)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = compute(word)
+        with self.lock:
+            self.entries[key] = value
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self, kind: str = None):
+        """Drop all entries (or only those of kind, e.g. 'lemma')."""
+        with self.lock:
+            if kind is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == kind]:
+                    del self.entries[key]
+
+    def load(self, path: str = NORMALIZATION_CACHE_FILE) -> int:
+        """Add the entries stored at path. Returns the number of loaded entries."""
+        if not os.path.isfile(path):
+            return 0
+        with open(path, encoding='utf-8') as f:
+            stored = json.load(f)
+        model_name = spacy_model.resolve_model()
+        entries = {kind: words for kind, words in stored['entries'].items()
+                   if kind != 'lemma' or stored.get('model') == model_name}
+        with self.lock:
+            for kind, words in entries.items():
+                for word, value in words.items():
+                    self.entries.setdefault((kind, word), value)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return sum(len(words) for words in entries.values())
+
+    def save(self, path: str = NORMALIZATION_CACHE_FILE):
+        with self.lock:
+            entries = dict()
+            for (kind, word), value in self.entries.items():
+                entries.setdefault(kind, {})[word] = value
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'model': spacy_model.resolve_model(), 'entries': entries}, f, ensure_ascii=False)
+        os.replace(f'{path}.tmp', path)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'max_size': self.max_size}
+
+
+normalization_cache = NormalizationCache()
+
+
+def enable_normalization_persistence(path: str = NORMALIZATION_CACHE_FILE) -> int:
+    """Load previously normalized words from path and write the cache back there at exit."""
+    atexit.register(normalization_cache.save, path)
+    return normalization_cache.load(path)
+
+
+def get_normalization_stats() -> dict:
+    return normalization_cache.stats()
+
+
+def _force_noun_lemmatization(word: str) -> str:
+    nlp = get_nlp()
+    doc = nlp.make_doc(word)
     for token in doc:
         token.pos_ = "NOUN"
     nlp.get_pipe("lemmatizer")(doc)
     return " ".join([token.lemma_.lower() for token in doc])
 
+def force_noun_lemmatization(word: str) -> str:
+    return normalization_cache.get('lemma', word.lower(), _force_noun_lemmatization)
+
 def lemmatize_text(text: str) -> set:
-    return set(token.lemma_.lower() for token in nlp(text.lower()) if not token.is_punct and not token.is_space)
+    return set(token.lemma_.lower() for token in get_nlp()(text.lower()) if not token.is_punct and not token.is_space)
+
+def lemmatize_texts(texts: Iterable[str], batch_size: int = 64, n_process: int = 1) -> Iterator[set]:
+    """Batched lemmatize_text: streams the texts through nlp.pipe and yields one lemma set per text."""
+    docs = get_nlp().pipe((text.lower() for text in texts), batch_size=batch_size, n_process=n_process)
+    for doc in docs:
+        yield set(token.lemma_.lower() for token in doc if not token.is_punct and not token.is_space)
 
 def stem_word(word: str) -> str:
-    return stemmer.stem(word.lower())
+    return normalization_cache.get('stem', word.lower(), get_stemmer().stem)
+
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def _stem_token(token: str) -> str:
+    return get_stemmer().stem(token)
 
-def stem_sentence(sentence: list[str]) -> set:
-    return {stem_word(word) for word in sentence.lower().split()}
+def stem_sentence(sentence: str) -> set:
+    # Answer tokens are stemmed outside of normalization_cache, so they neither evict entity lemmas nor get persisted.
+    return {_stem_token(word) for word in sentence.lower().split()}
@@ -1,11 +1,18 @@
+import os
+
 import requests
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type, before_sleep_log
 import logging
 
 from config import Credentials
+from utils.rate_limit import estimate_tokens, get_limiter
 
 logger = logging.getLogger(__name__)
 
+DEEPL_URL = 'https://api-free.deepl.com'
+# Overrides DEEPL_URL, e.g. with a utils/mock_server.py instance.
+DEEPL_URL_ENV = 'ITDEPENDS_DEEPL_URL'
+
 class RateLimitError(requests.exceptions.HTTPError):
     """Custom to detect HTTP 429 separately if needed."""
 
@@ -15,27 +22,29 @@ def raise_for_429(response):
         raise RateLimitError(f"429 Too Many Requests: {response.text}", response=response)
     response.raise_for_status()
 
+# 429s are retried (honoring Retry-After) by the deepl rate limiter, invalid responses here.
 @retry(
-    retry=(
-        retry_if_exception_type(requests.exceptions.JSONDecodeError) |
-        retry_if_exception_type(RateLimitError)
-    ),
+    retry=retry_if_exception_type(requests.exceptions.JSONDecodeError),
     wait=wait_exponential(multiplier=2, min=2, max=30),
     stop=stop_after_attempt(10),
     before_sleep=before_sleep_log(logger, logging.WARNING)
 )
 def translate(text: str, source_lang: str = 'EN', target_lang: str = 'DE') -> str:
-    response = requests.post(
-        "https://api-free.deepl.com/v2/translate",
-        data={
-            "auth_key": Credentials.deepl_api_key,
-            "text": text,
-            "source_lang": source_lang,
-            "target_lang": target_lang,
-            "tag_handling": "html",
-            "outline_detection": "0"
-        }
-    )
-    raise_for_429(response)
+    def request():
+        response = requests.post(
+            f"{os.environ.get(DEEPL_URL_ENV) or DEEPL_URL}/v2/translate",
+            data={
+                "auth_key": Credentials.deepl_api_key,
+                "text": text,
+                "source_lang": source_lang,
+                "target_lang": target_lang,
+                "tag_handling": "html",
+                "outline_detection": "0"
+            }
+        )
+        raise_for_429(response)
+        return response
+
+    response = get_limiter('deepl').call(request, tokens=estimate_tokens(text))
     result = response.json()
     return result['translations'][0]['text']
\ No newline at end of file
@@ -0,0 +1,48 @@
+from evaluation.analysis import Analysis
+
+
+def response(correctness: str, fine_category: str = 'Direct', coarse_type: str = 'Single') -> dict:
+    return {
+        'judge_response': {'correctness': correctness, 'coarse_type': coarse_type, 'fine_category': fine_category,
+                           'mentioned_entities': ['bat']},
+        'entry': {'question': 'Can it fly?', 'positive': [{'entity': 'bat'}, {'entity': 'owl'}],
+                  'negative': {'entity': 'cup'}},
+    }
+
+
+def test_summaries_of_groups_without_correct_answers():
+    analysis = Analysis('shared_ref')
+    wrong = analysis.analyze_responses([response('Wrong', 'Wrong Entity'), response('Wrong', 'Wrong Entity')])
+    correct = analysis.analyze_responses([response('Correct'), response('Wrong', 'Wrong Entity')])
+    stats = {lang: {'normal': wrong, 'simple': correct} for lang in ('en', 'de')}
+
+    for summary in (Analysis.summarize_dpo(stats), Analysis.summarize(stats)):
+        assert summary['correct']['normal'] == 0
+        assert summary['correct_direct']['normal'] == 0
+        assert summary['correct']['simple'] == 2 * 50 / 5
+        assert summary['correct_direct']['simple'] == 2 * 100 / 5
+
+
+def test_results_are_reused_until_an_input_file_changes(tmp_path):
+    judged_file = tmp_path / 'judged' / 'shared_ref' / 'en' / 'model' / 'outputs.jsonl'
+    judged_file.parent.mkdir(parents=True)
+    judged_file.write_text('{}\n')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'run': len(calls)}
+
+    def analysis():
+        return Analysis('shared_ref', cache_dir=str(tmp_path / 'cache'), judged_dir=str(tmp_path / 'judged'))
+
+    first = analysis()
+    assert first.cached('analyze', 'model', compute) == {'run': 1}
+    assert first.cached('analyze', 'model', compute) == {'run': 1}
+    assert analysis().cached('analyze', 'model', compute) == {'run': 1}  # from disk
+    assert first.cached('ablate_entity_position', 'model', compute) == {'run': 2}
+
+    judged_file.write_text('{}\n{}\n')
+    assert first.cached('analyze', 'model', compute) == {'run': 3}
+    assert analysis().cached('analyze', 'model', compute) == {'run': 3}
+    assert first.cache_stats == {'hits': 1, 'misses': 3}
@@ -0,0 +1,93 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from data.loader import JSONLineReader
+from utils import batch_manager
+from utils.batch_manager import BatchManager
+from utils.mock_server import MockServer
+from utils.openai_client import get_client
+
+
+def request(custom_id: str) -> dict:
+    return {'custom_id': custom_id, 'method': 'POST', 'url': '/v1/responses',
+            'body': {'model': 'mock', 'input': custom_id}}
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_manager, 'MAX_REQUESTS_PER_FILE', 2)
+    monkeypatch.setattr(batch_manager, 'POLL_INTERVAL', 0)
+    input_file = tmp_path / 'input.jsonl'
+    input_file.write_text(''.join(json.dumps(request(f'req-{i}')) + '\n' for i in range(5)))
+    return {'input_file': str(input_file), 'output_file': str(tmp_path / 'output.jsonl'),
+            'state_file': str(tmp_path / 'output.jsonl.state.json'), 'shard_dir': str(tmp_path / 'shards')}
+
+
+def output_ids(job: dict) -> list[str]:
+    return sorted(result['custom_id'] for result in JSONLineReader().iter_read(job['output_file']))
+
+
+def read_state(job: dict) -> dict:
+    return json.loads(Path(job['state_file']).read_text())
+
+
+def test_create_shards_within_the_limits(job, monkeypatch):
+    manager = BatchManager(**job, client=SimpleNamespace())
+    shards = manager.create_shards(exclude={'req-1'})
+    assert [shard['requests'] for shard in shards] == [2, 2]
+    shard_ids = [json.loads(line)['custom_id'] for shard in shards for line in Path(shard['file']).read_text().splitlines()]
+    assert shard_ids == ['req-0', 'req-2', 'req-3', 'req-4']
+
+    line_bytes = len(json.dumps(request('req-0'))) + 1
+    monkeypatch.setattr(batch_manager, 'MAX_FILE_BYTES', line_bytes)
+    assert [shard['requests'] for shard in manager.create_shards(exclude=set())] == [1] * 5
+
+
+def test_run_resubmits_invalid_results(job):
+    answers = {'req-3': ['no json', '{"ok": true}']}
+
+    def responder(endpoint, body):
+        return answers.get(body['input'], ['{"ok": true}']).pop(0)
+
+    with MockServer(responder=responder) as server, server.use():
+        failed = BatchManager(**job, client=get_client('openai')).run()
+
+    assert failed == []
+    assert output_ids(job) == [f'req-{i}' for i in range(5)]
+    state = read_state(job)
+    assert state['attempt'] == 2
+    assert [(shard['attempt'], shard['requests'], shard['downloaded']) for shard in state['shards']] == \
+           [(0, 2, True), (0, 2, True), (0, 1, True), (1, 1, True)]
+    assert len(server.batches) == 4
+
+
+def test_run_gives_up_after_max_resubmits(job, monkeypatch):
+    monkeypatch.setattr(batch_manager, 'MAX_RESUBMITS', 1)
+    with MockServer(responder=lambda endpoint, body: 'no json' if body['input'] == 'req-0' else '{}') as server, \
+            server.use():
+        failed = BatchManager(**job, client=get_client('openai')).run()
+    assert failed == ['req-0']
+    assert output_ids(job) == [f'req-{i}' for i in range(1, 5)]
+    assert read_state(job)['failed_ids'] == ['req-0']
+
+
+def test_resume_finds_the_batch_of_an_uploaded_shard(job):
+    with MockServer(responder=lambda endpoint, body: '{}') as server, server.use():
+        client = get_client('openai')
+        manager = BatchManager(**job, client=client)
+        manager.state['shards'] = manager.create_shards(exclude=set())
+        # The first run uploaded and submitted the first shard, but stopped before recording its batch.
+        shard = manager.state['shards'][0]
+        with open(shard['file'], 'rb') as f:
+            shard['file_id'] = client.files.create(file=f, purpose='batch').id
+        client.batches.create(input_file_id=shard['file_id'], endpoint='/v1/responses', completion_window='24h')
+        manager.save_state()
+
+        failed = BatchManager.resume(job['state_file'], client=client).run()
+
+    assert failed == []
+    assert output_ids(job) == [f'req-{i}' for i in range(5)]
+    assert len(server.batches) == 3  # no duplicate batch for the first shard
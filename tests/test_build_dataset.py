@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip('datasets')
+
+import build_dataset
+
+QUESTIONS = {'questions-can-fly.json': {'en': 'Can it fly?', 'de': 'Kann es fliegen?'}}
+
+
+def context(entity: str) -> dict:
+    return {'entity': entity, 'lang_versions': {lang: {'entity': f'{entity} ({lang})', 'context': f'A {entity}.'}
+                                                for lang in ('en', 'de')}}
+
+
+DATASET = [
+    {'question': 'questions-can-fly.json', 'positive': [context('bat'), context('bird')], 'negative': context('rock')},
+    {'question': 'questions-can-fly.json', 'positive': [context('plane')], 'negative': context('fish')},
+]
+
+
+@pytest.mark.parametrize('lang', ['en', 'de'])
+def test_streaming_and_in_memory_build_the_same_rows(monkeypatch, lang):
+    monkeypatch.setattr(build_dataset, 'STREAMING', True)
+    streamed = build_dataset.extract_lang_version(DATASET, QUESTIONS, lang)
+    monkeypatch.setattr(build_dataset, 'STREAMING', False)
+    in_memory = build_dataset.extract_lang_version(DATASET, QUESTIONS, lang)
+
+    assert streamed.features == in_memory.features
+    assert streamed.to_list() == in_memory.to_list() == list(build_dataset.iter_lang_version(DATASET, QUESTIONS, lang))
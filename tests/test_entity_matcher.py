@@ -0,0 +1,60 @@
+import copy
+
+import pytest
+
+spacy = pytest.importorskip('spacy')
+
+import spacy_model
+from evaluation.judge import Judge
+from utils.entity_matcher import ABSENT, FOUND, UNDECIDED, EntityMatcher
+from utils.spacy_utils import normalization_cache
+
+ENTITIES = ['bat', 'butterfly', 'goose', 'wolf', 'cat', 'hot air balloon', 'fish', 'helicopter']
+
+ANSWERS = [
+    ('Bats can fly, butterflies too.', ['bat', 'butterfly'], 'fish'),
+    ('A goose flies south, geese fly in flocks.', ['goose', 'wolf'], 'cat'),
+    ('Wolves cannot fly; that category does not apply to a cat either.', ['wolf', 'bat'], 'cat'),
+    ('A hot air balloon rises because hot air is lighter.', ['hot air balloon', 'helicopter'], 'fish'),
+    ('Helicopters and fishing boats.', ['helicopter', 'butterfly'], 'fish'),
+    ('None of them: batteries, catalogs and wolfram.', ['bat', 'wolf'], 'cat'),
+    ('', ['goose', 'bat'], 'helicopter'),
+]
+
+
+@pytest.fixture
+def nlp(monkeypatch):
+    """A blank English pipeline with the lookup lemmatizer, standing in for the (large) trained model."""
+    pytest.importorskip('spacy_lookups_data')
+    nlp = spacy.blank('en')
+    nlp.add_pipe('lemmatizer', config={'mode': 'lookup'})
+    nlp.initialize()
+    monkeypatch.setattr(spacy_model, '_nlp', nlp)
+    normalization_cache.clear('lemma')
+    yield nlp
+    normalization_cache.clear('lemma')
+
+
+def responses() -> list[dict]:
+    return [{'answer': answer, 'entry': {'positive': [{'entity': e} for e in positive], 'negative': {'entity': negative}},
+             'judge_response': {'coarse_type': 'answer_attempt'}}
+            for answer, positive, negative in ANSWERS]
+
+
+def test_match_statuses():
+    matcher = EntityMatcher({'en': ENTITIES})
+    assert matcher.match('Bats, a cat and the category.', ['bat', 'cat', 'wolf', 'Mole']) == \
+           {'bat': UNDECIDED, 'cat': FOUND, 'wolf': ABSENT, 'mole': ABSENT}
+    assert matcher.match('Two geese and wolves.', ['goose', 'wolf']) == {'goose': FOUND, 'wolf': FOUND}
+
+
+def test_matcher_agrees_with_spacy_rules(nlp):
+    judge = Judge('shared_ref')
+    by_spacy, by_matcher = responses(), responses()
+    judge.rerun_rule_based(by_spacy)
+    judge.rerun_rule_based(by_matcher, matcher=EntityMatcher({'en': ENTITIES}))
+
+    for spacy_response, matcher_response in zip(by_spacy, by_matcher):
+        expected, actual = spacy_response['judge_response'], matcher_response['judge_response']
+        assert sorted(actual.pop('pos')) == sorted(expected.pop('pos')), matcher_response['answer']
+        assert actual == expected, matcher_response['answer']
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from data import loader
+from data.loader import JSONCodec, JSONLineReader, JSONLineWriter, RESPONSE_FIELDS, ResponseRecord
+
+BACKENDS = ['json'] + [name for name, module in (('orjson', loader.orjson), ('msgspec', loader.msgspec)) if module]
+
+ROWS = [
+    {'answer': 'A bat can fly.', 'conversation': [{'role': 'user', 'content': 'Can it fly?'}],
+     'entry': {'entity': 'bat', 'lang': 'en'}, 'judge_response': {'category': 'Correct'}},
+    {'answer': 'Ein Schläger – 🦇', 'entry': {'entity': 'Schläger'}, 'extra': 1},
+    # mistyped values are kept as they are, not dropped
+    {'answer': 42, 'conversation': {'role': 'user'}, 'entry': ['bat'], 'judge_response': 'Correct'},
+    {'answer': None, 'conversation': None},
+    {},
+]
+
+
+@pytest.fixture
+def jsonl_file(tmp_path):
+    file = tmp_path / 'outputs.jsonl'
+    lines = [json.dumps(row, ensure_ascii=False) for row in ROWS]
+    lines.insert(2, '{"answer": "truncated')
+    file.write_text('\n'.join(lines) + '\n\n', encoding='utf-8')
+    return file
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_read_the_same_rows(jsonl_file, backend):
+    assert JSONLineReader(codec=JSONCodec(backend)).read(jsonl_file) == ROWS
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_project_the_same_fields(jsonl_file, backend):
+    rows = list(JSONLineReader(codec=JSONCodec(backend)).iter_read(jsonl_file, fields=['answer', 'entry']))
+    assert rows == [{key: row[key] for key in ('answer', 'entry') if key in row} for row in ROWS]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_decode_the_same_records(jsonl_file, backend):
+    records = JSONLineReader(codec=JSONCodec(backend), record_type=ResponseRecord).read(jsonl_file)
+    assert [[record.get(key) for key in RESPONSE_FIELDS] for record in records] == \
+           [[row.get(key) for key in RESPONSE_FIELDS] for row in ROWS]
+
+
+@pytest.mark.parametrize('tail, expected', [
+    ('', '{"a": 1}\n'),
+    ('{"a": 2}', '{"a": 1}\n{"a": 2}\n'),
+    ('{"a": ', '{"a": 1}\n'),
+])
+def test_writer_repairs_the_last_line_before_appending(tmp_path, tail, expected):
+    file = tmp_path / 'outputs.jsonl'
+    file.write_text('{"a": 1}\n' + tail, encoding='utf-8')
+    with JSONLineWriter(file, buffer_size=1) as writer:
+        writer.write({'a': 3})
+    assert file.read_text(encoding='utf-8') == expected + '{"a": 3}\n'
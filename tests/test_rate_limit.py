@@ -0,0 +1,109 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import rate_limit
+from utils.rate_limit import AdaptiveConcurrency, RateLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class APIError(Exception):
+    def __init__(self, status_code: int, headers: dict = None):
+        super().__init__(f'status {status_code}')
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    monkeypatch.setattr(rate_limit.random, 'uniform', lambda low, high: low)
+    return clock
+
+
+def test_token_bucket_waits_for_the_refill(clock):
+    bucket = TokenBucket(per_minute=60, burst_seconds=5)
+    assert bucket.capacity == 5
+    assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+    assert bucket.acquire(2) == pytest.approx(2.0)
+    clock.now += 10
+    assert bucket.acquire() == 0.0  # refilled, but never above capacity
+    assert bucket.level == pytest.approx(4.0)
+
+
+def test_concurrency_halves_once_per_cooldown_and_recovers(clock):
+    concurrency = AdaptiveConcurrency(max_limit=8)
+    concurrency.on_rate_limit(retry_after=3)
+    concurrency.on_rate_limit()  # same burst of 429s
+    assert concurrency.limit == 4
+    assert concurrency.paused_until == clock.now + 3
+
+    for expected in (2, 1, 1):
+        clock.now += rate_limit.DECREASE_COOLDOWN
+        concurrency.on_rate_limit()
+        assert concurrency.limit == expected
+
+    # +1/limit per success: about one more request in flight per round of successful requests
+    rounds = 0
+    while concurrency.limit < 8:
+        for _ in range(int(concurrency.limit)):
+            concurrency.acquire()
+        for _ in range(int(concurrency.limit)):
+            concurrency.release(success=True)
+        rounds += 1
+    assert concurrency.limit == 8
+    assert 7 <= rounds <= 10
+
+
+def test_call_retries_rate_limits_after_retry_after(clock):
+    responses = [APIError(429, {'retry-after': '5'}), APIError(429, {'retry-after-ms': '1500'}), 'done']
+
+    def func():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    limiter = RateLimiter('test', concurrency=4)
+    assert limiter.call(func) == 'done'
+    assert clock.slept == [5.0, 1.5]
+    stats = limiter.get_stats()
+    assert (stats['requests'], stats['rate_limited'], stats['retries']) == (3, 2, 2)
+    assert limiter.concurrency.limit == 2  # 4 -> 2 -> 1 (the 429s are a cooldown apart), then +1 on success
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_call_backs_off_transient_errors_and_gives_up(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'MAX_RETRIES', 2)
+    limiter = RateLimiter('test', concurrency=4)
+
+    def server_error():
+        raise APIError(503)
+
+    with pytest.raises(APIError):
+        limiter.call(server_error)
+    assert clock.slept == [0.5, 1.0]  # BACKOFF_BASE * 2 ** attempt, with the lowest jitter
+    assert limiter.concurrency.limit == 4
+
+    def bad_request():
+        raise APIError(400)
+
+    with pytest.raises(APIError):
+        limiter.call(bad_request)
+    assert limiter.get_stats()['retries'] == 2
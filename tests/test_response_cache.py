@@ -0,0 +1,48 @@
+import itertools
+from types import SimpleNamespace
+
+from utils import response_cache
+from utils.response_cache import ResponseCache
+
+
+def test_read_only_cache_on_a_missing_file_is_empty(tmp_path):
+    path = tmp_path / 'missing.sqlite'
+    cache = ResponseCache(path, read_only=True)
+    cache.put('key', 'value')
+    cache.delete('key')
+    assert cache.get('key') is None
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'evictions': 0, 'entries': 0, 'size_bytes': 0}
+    cache.close()
+    assert not path.exists()
+
+
+def test_read_only_cache_serves_existing_entries(tmp_path):
+    path = tmp_path / 'cache.sqlite'
+    cache = ResponseCache(path)
+    cache.put('key', 'value')
+    cache.close()
+
+    cache = ResponseCache(path, read_only=True)
+    assert cache.get('key') == 'value'
+    cache.put('other', 'value')
+    assert cache.get('other') is None
+    cache.close()
+
+
+def test_evicts_least_recently_used_entries(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(response_cache, 'time', SimpleNamespace(time=lambda: next(clock)))
+    cache = ResponseCache(tmp_path / 'cache.sqlite', max_size_mb=30 / (1024 * 1024))
+    for key in 'abc':
+        cache.put(key, key * 10)
+    assert cache.get('a') == 'a' * 10  # now b is the least recently used entry
+
+    cache.put('d', 'd' * 10)
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['a' * 10, 'c' * 10, 'd' * 10]
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size_bytes'] == 30
+
+    cache.put('e', 'e' * 25)  # a, c and d have to go
+    assert cache.stats() == {'hits': 4, 'misses': 1, 'evictions': 4, 'entries': 1, 'size_bytes': 25}
+    cache.close()
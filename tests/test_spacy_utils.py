@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import spacy_model
+from utils import spacy_utils
+from utils.spacy_utils import NormalizationCache
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """The first model is not installed, so the second ('json', an importable module) is the one in use."""
+    def fail():
+        raise AssertionError('the pipeline must not be loaded')
+
+    monkeypatch.setattr(spacy_model, 'SPACY_MODELS', ['not_installed_model', 'json'])
+    monkeypatch.setattr(spacy_model, '_nlp', None)
+    monkeypatch.setattr(spacy_model, 'get_nlp', fail)
+    monkeypatch.setattr(spacy_utils, 'get_nlp', fail)
+
+
+@pytest.mark.parametrize('stored_model, loaded', [('json', 2), ('not_installed_model', 1)])
+def test_load_drops_lemmas_of_another_model(tmp_path, models, stored_model, loaded):
+    path = tmp_path / 'normalization_cache.json'
+    path.write_text(json.dumps({'model': stored_model,
+                                'entries': {'lemma': {'bats': 'bat'}, 'stem': {'flying': 'fli'}}}))
+    cache = NormalizationCache()
+    assert spacy_model.resolve_model() == 'json'
+    assert cache.load(path) == loaded
+    assert (('lemma', 'bats') in cache.entries) == (loaded == 2)
+    assert cache.entries[('stem', 'flying')] == 'fli'
+
+
+def test_save_tags_the_resolved_model(tmp_path, models):
+    path = tmp_path / 'normalization_cache.json'
+    cache = NormalizationCache()
+    cache.get('lemma', 'bats', lambda word: 'bat')
+    cache.save(path)
+    assert json.loads(path.read_text()) == {'model': 'json', 'entries': {'lemma': {'bats': 'bat'}}}
+
+
+@pytest.fixture
+def spacy_load(monkeypatch):
+    """spacy.load that only knows en_core_web_sm, recording the models it was asked for."""
+    spacy = pytest.importorskip('spacy')
+    loaded = []
+
+    def load(name, disable=()):
+        loaded.append(name)
+        if name != 'en_core_web_sm':
+            raise OSError(f'[E050] Can\'t find model {name!r}.')
+        return f'pipeline {name}'
+
+    monkeypatch.setattr(spacy, 'load', load)
+    monkeypatch.setattr(spacy_model, '_nlp', None)
+    monkeypatch.setattr(spacy_model, 'SPACY_MODEL', spacy_model.SPACY_MODEL)
+    return loaded
+
+
+def test_get_nlp_loads_the_first_installed_model_once(monkeypatch, spacy_load):
+    monkeypatch.setattr(spacy_model, 'SPACY_MODELS', ['en_core_web_trf', 'en_core_web_sm'])
+    assert spacy_load == []
+    assert spacy_model.get_nlp() == 'pipeline en_core_web_sm'
+    assert spacy_model.get_nlp() == 'pipeline en_core_web_sm'
+    assert spacy_load == ['en_core_web_trf', 'en_core_web_sm']
+    assert spacy_model.SPACY_MODEL == spacy_model.resolve_model() == 'en_core_web_sm'
+
+
+def test_get_nlp_fails_without_an_installed_model(monkeypatch, spacy_load):
+    monkeypatch.setattr(spacy_model, 'SPACY_MODELS', ['en_core_web_trf'])
+    with pytest.raises(OSError, match='python -m spacy download en_core_web_trf'):
+        spacy_model.get_nlp()